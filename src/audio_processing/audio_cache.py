@@ -0,0 +1,62 @@
+# audio_cache.py
+import os
+import numpy as np
+from utils.stage_cache import StageCache, STAGE_CACHE_PATH, hash_parts, file_hash
+
+WHISPER_SAMPLE_RATE = 16000
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+
+def decode(file_path: str, sample_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode an audio file to mono float32 samples at sample_rate.
+    """
+    import librosa
+
+    print(f"Decoding audio file: {file_path}...")
+    samples, _ = librosa.load(file_path, sr=sample_rate, mono=True)
+    return samples.astype(np.float32, copy=False)
+
+class AudioCache(StageCache):
+    """
+    Decoded audio as .npy files under <root>/audio/, keyed by the hash of the source file and the
+    sample rate, and memory-mapped on load so repeat runs skip decoding entirely.
+    """
+    extension = ".npy"
+
+    def __init__(self, root: str = STAGE_CACHE_PATH, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    def read(self, path: str):
+        return np.load(path, mmap_mode='r')
+
+    def write(self, file, value):
+        np.save(file, np.asarray(value, dtype=np.float32))
+
+    def load(self, file_path: str, sample_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+        """
+        Returns the decoded samples of an audio file, decoding and caching them on a miss.
+        Args:
+            file_path (str): Path to the audio file.
+            sample_rate (int): Target sample rate.
+        Returns:
+            np.ndarray: Read-only memory-mapped mono float32 samples.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Audio file not found: {file_path}")
+        key = hash_parts(file_hash(file_path), sample_rate)
+        samples = self.get("audio", key)
+        if samples is None:
+            self.put("audio", key, decode(file_path, sample_rate))
+            samples = self.get("audio", key)
+        return samples
+
+_audio_cache = None
+
+def get_audio_cache() -> AudioCache:
+    global _audio_cache
+    if _audio_cache is None:
+        _audio_cache = AudioCache()
+    return _audio_cache
+
+def load_samples(file_path: str, sample_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    return get_audio_cache().load(file_path, sample_rate)
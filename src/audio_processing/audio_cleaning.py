@@ -1,27 +1,76 @@
-# broken
 # audio_cleaning.py
 from pydub import AudioSegment
 import noisereduce as nr
 import numpy as np
-import os
-import librosa
+import soundfile as sf
+from src.audio_processing.audio_cache import load_samples, WHISPER_SAMPLE_RATE
 
 def load_audio(file_path: str):
     """
-    Load an audio file using pydub.
+    Load an audio file as a pydub AudioSegment, from the decoded audio cache.
     Args:
         file_path (str): Path to the audio file.
     Returns:
-        AudioSegment: The loaded audio segment.
+        AudioSegment: The loaded audio segment, 16 kHz mono 16-bit.
     """
     print(f"Loading audio file: {file_path}...")
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Audio file not found: {file_path}")
-
-    audio = AudioSegment.from_file(file_path)
+    samples = load_samples(file_path)
+    audio = AudioSegment(
+        (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes(),
+        frame_rate=WHISPER_SAMPLE_RATE,
+        sample_width=2,
+        channels=1
+    )
     print("Audio loaded successfully.")
     return audio
 
+def decode_audio(file_path: str, sample_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode an audio file to mono float32 samples, resampled once to Whisper's sample rate.
+    Decoded audio is cached on disk, so repeat runs skip decoding.
+    Args:
+        file_path (str): Path to the audio file.
+        sample_rate (int): Target sample rate.
+    Returns:
+        np.ndarray: float32 samples in [-1, 1], memory-mapped read-only.
+    """
+    return load_samples(file_path, sample_rate)
+
+def reduce_noise_array(samples: np.ndarray, sample_rate: int = WHISPER_SAMPLE_RATE, block_seconds: float = 30.0, overlap_seconds: float = 1.0) -> np.ndarray:
+    """
+    Noise reduction on a float32 buffer, in overlapping blocks so the spectrogram working set stays
+    bounded on long recordings. Consecutive blocks are linearly crossfaded over their overlap.
+    Args:
+        samples (np.ndarray): Mono float32 samples.
+        sample_rate (int): Sample rate of the samples.
+        block_seconds (float): Length of each processed block.
+        overlap_seconds (float): Overlap between consecutive blocks.
+    Returns:
+        np.ndarray: The cleaned float32 samples, same length as the input.
+    """
+    block = int(block_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+    cleaned = np.empty(len(samples), dtype=np.float32)
+    for start in range(0, max(len(samples) - overlap, 1), block - overlap):
+        reduced = nr.reduce_noise(y=samples[start:start + block], sr=sample_rate).astype(np.float32, copy=False)
+        fade = min(overlap, len(reduced)) if start else 0
+        if fade:
+            weights = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+            cleaned[start:start + fade] = cleaned[start:start + fade] * (1 - weights) + reduced[:fade] * weights
+        cleaned[start + fade:start + len(reduced)] = reduced[fade:]
+    return cleaned
+
+def clean_audio(file_path: str) -> np.ndarray:
+    """
+    Decode and denoise an audio file in memory. The result can be passed straight to transcribe_audio.
+    Args:
+        file_path (str): Path to the audio file.
+    Returns:
+        np.ndarray: Cleaned 16 kHz mono float32 samples.
+    """
+    print(f"Performing noise reduction on: {file_path}...")
+    return reduce_noise_array(decode_audio(file_path))
+
 def reduce_noise(file_path: str, output_file: str):
     """
     Perform noise reduction on an audio file.
@@ -29,24 +78,7 @@ def reduce_noise(file_path: str, output_file: str):
         file_path (str): Path to the input audio file.
         output_file (str): Path to save the noise-reduced audio file.
     """
-    print(f"Performing noise reduction on: {file_path}...")
-
-    # Load audio file with librosa
-    y, sr = librosa.load(file_path, sr=None)
-
-    # Perform noise reduction
-    reduced_noise = nr.reduce_noise(y=y, sr=sr)
-
-    # Convert back to AudioSegment for exporting
-    audio_reduced = AudioSegment(
-        reduced_noise.tobytes(), 
-        frame_rate=sr,
-        sample_width=reduced_noise.dtype.itemsize, 
-        channels=1
-    )
-
-    # Export noise-reduced audio
-    audio_reduced.export(output_file, format="wav")
+    sf.write(output_file, clean_audio(file_path), WHISPER_SAMPLE_RATE, subtype="FLOAT")
     print(f"Noise-reduced audio saved to {output_file}")
 
 def save_audio(audio: AudioSegment, output_path: str):
@@ -66,4 +98,4 @@ def main():
     reduce_noise(input_file_path, output_file_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
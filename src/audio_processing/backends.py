@@ -0,0 +1,100 @@
+# backends.py
+import os
+import importlib.util
+from abc import ABC, abstractmethod
+
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "whisper")
+
+class TranscriptionBackend(ABC):
+    """
+    A loaded speech-to-text model. transcribe follows openai-whisper's interface, taking a path or
+    16 kHz mono float32 samples and returning {"text": ...}, so every caller works with any backend.
+    """
+    name = None
+    # Module the backend imports, None when it needs nothing outside requirements.txt.
+    package = None
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @abstractmethod
+    def transcribe(self, audio, initial_prompt: str = None, **options) -> dict:
+        ...
+
+class WhisperBackend(TranscriptionBackend):
+    """
+    The reference openai-whisper implementation, in PyTorch.
+    """
+    name = "whisper"
+    package = "whisper"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import whisper
+
+        self.model = whisper.load_model(model_name)
+
+    def transcribe(self, audio, initial_prompt: str = None, **options) -> dict:
+        return self.model.transcribe(audio, initial_prompt=initial_prompt, **options)
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    CTranslate2 port of Whisper (faster-whisper) with int8 weights, several times faster on CPU.
+    """
+    name = "faster-whisper"
+    # Optional, not in requirements.txt: pip install faster-whisper
+    package = "faster_whisper"
+
+    def __init__(self, model_name: str, compute_type: str = os.getenv("TRANSCRIPTION_COMPUTE_TYPE", "int8"), cpu_threads: int = int(os.getenv("TRANSCRIPTION_CPU_THREADS", 0))):
+        super().__init__(model_name)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ImportError("The faster-whisper backend needs the faster-whisper package: pip install faster-whisper") from None
+
+        # faster-whisper names the latest large model explicitly.
+        self.model = WhisperModel("large-v3" if model_name == "large" else model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio, initial_prompt: str = None, **options) -> dict:
+        segments, _ = self.model.transcribe(audio, initial_prompt=initial_prompt, beam_size=5)
+        return {"text": "".join(segment.text for segment in segments)}
+
+class FakeBackend(TranscriptionBackend):
+    """
+    Returns a fixed text without loading anything, for tests.
+    """
+    name = "fake"
+
+    def __init__(self, model_name: str = "fake", text: str = "Neuro WDL. Cardiac WDL."):
+        super().__init__(model_name)
+        self.text = text
+        self.number_of_calls = 0
+
+    def transcribe(self, audio, initial_prompt: str = None, **options) -> dict:
+        self.number_of_calls += 1
+        return {"text": self.text}
+
+BACKENDS = {backend.name: backend for backend in (WhisperBackend, FasterWhisperBackend, FakeBackend)}
+
+def installed_backends(include_fake: bool = False) -> list:
+    """
+    Names of the backends whose package can be imported in this environment.
+    """
+    return [
+        name for name, backend in BACKENDS.items()
+        if (include_fake or backend is not FakeBackend) and (backend.package is None or importlib.util.find_spec(backend.package) is not None)
+    ]
+
+def load_backend(model_name: str = "large", backend: str = None) -> TranscriptionBackend:
+    """
+    Loads a transcription backend.
+    Args:
+        model_name (str): Model size ('tiny', 'base', 'small', 'medium', 'large').
+        backend (str): One of BACKENDS, defaults to the TRANSCRIPTION_BACKEND environment variable.
+    Returns:
+        TranscriptionBackend: The loaded backend.
+    """
+    backend = backend or TRANSCRIPTION_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](model_name)
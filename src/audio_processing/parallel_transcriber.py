@@ -0,0 +1,97 @@
+# parallel_transcriber.py
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from src.audio_processing.audio_cache import get_audio_cache, WHISPER_SAMPLE_RATE
+from src.audio_processing.transcriber import load_model, transcribe_audio
+
+FRAME_SECONDS = 0.03
+
+# Loaded once per worker process by init_worker.
+_worker_model = None
+
+def init_worker(model_name: str, threads_per_worker: int, model_loader=load_model):
+    """
+    Process pool initializer: pins the number of BLAS/torch threads, then loads the model once.
+    """
+    global _worker_model
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads_per_worker)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+    _worker_model = model_loader(model_name)
+
+def transcribe_segment(samples_path: str, start: int, end: int) -> str:
+    """
+    Transcribes samples[start:end] of a decoded audio cache entry with the worker's model.
+    """
+    samples = np.array(np.load(samples_path, mmap_mode='r')[start:end])
+    return transcribe_audio(samples, _worker_model).strip()
+
+def segment_bounds(samples: np.ndarray, segment_seconds: float = None, search_seconds: float = 5.0) -> list:
+    """
+    Splits a recording into segments of about segment_seconds, cutting at the quietest frame within
+    search_seconds of each target boundary so words are not cut in half.
+    Returns:
+        list: (start, end) sample indices covering the whole recording.
+    """
+    if not segment_seconds or len(samples) <= segment_seconds * WHISPER_SAMPLE_RATE:
+        return [(0, len(samples))]
+    frame = int(FRAME_SECONDS * WHISPER_SAMPLE_RATE)
+    search = int(search_seconds * WHISPER_SAMPLE_RATE)
+    cuts = [0]
+    target = int(segment_seconds * WHISPER_SAMPLE_RATE)
+    while len(samples) - cuts[-1] > target + search:
+        low = max(cuts[-1] + target - search, cuts[-1] + frame)
+        window = np.asarray(samples[low:cuts[-1] + target + search], dtype=np.float32)
+        frames = window[:len(window) // frame * frame].reshape(-1, frame)
+        cuts.append(low + int(np.argmin(np.mean(frames ** 2, axis=1))) * frame)
+    return list(zip(cuts, cuts[1:] + [len(samples)]))
+
+class ParallelTranscriber():
+    """
+    Transcribes recordings on a pool of worker processes, each with its own resident model.
+    Recordings are decoded once into the audio cache, split into segments when segment_seconds
+    is set, and segments from all files are queued together, so long recordings spread across
+    workers too. Segment transcripts are stitched back in order.
+    """
+    def __init__(self, model_name: str = "large", workers: int = None, threads_per_worker: int = 1, segment_seconds: float = None, model_loader=load_model, audio_cache=None):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.segment_seconds = segment_seconds
+        self.audio_cache = audio_cache or get_audio_cache()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_worker,
+            initargs=(model_name, threads_per_worker, model_loader),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def transcribe_files(self, file_paths: list) -> list:
+        """
+        Args:
+            file_paths (list): Paths to audio files.
+        Returns:
+            list: The transcribed text of each file, in input order.
+        """
+        jobs = []
+        for file_path in file_paths:
+            samples = self.audio_cache.load(file_path)
+            jobs.append([
+                self.executor.submit(transcribe_segment, samples.filename, start, end)
+                for start, end in segment_bounds(samples, self.segment_seconds)
+            ])
+        return [" ".join(text for text in (future.result() for future in futures) if text) for futures in jobs]
+
+    def transcribe(self, file_path: str) -> str:
+        return self.transcribe_files([file_path])[0]
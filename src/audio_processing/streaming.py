@@ -0,0 +1,147 @@
+# streaming.py
+import os
+import re
+import time
+import socket
+import argparse
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+BYTES_PER_SAMPLE = 2
+
+def follow_file(file_path: str, block_bytes: int = 32000, poll_interval: float = 0.2, idle_timeout: float = 5.0):
+    """
+    Yields the bytes of a file as it is being appended to, and stops once it has not grown for idle_timeout seconds.
+    Args:
+        file_path (str): Raw 16 kHz mono 16-bit PCM file being written by the recorder.
+        block_bytes (int): Maximum number of bytes yielded at once.
+        poll_interval (float): Seconds between checks for new data.
+        idle_timeout (float): Seconds without new data after which the recording is considered finished.
+    """
+    while not os.path.exists(file_path):
+        time.sleep(poll_interval)
+    last_data = time.monotonic()
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(block_bytes)
+            if block:
+                last_data = time.monotonic()
+                yield block
+            elif time.monotonic() - last_data > idle_timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+
+def socket_source(address, block_bytes: int = 32000):
+    """
+    Accepts one connection on a local socket and yields the raw PCM bytes sent over it until it is closed.
+    Args:
+        address: Path of a Unix socket, or a (host, port) tuple for TCP.
+    """
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    if family == socket.AF_UNIX and os.path.exists(address):
+        os.remove(address)
+    with socket.socket(family, socket.SOCK_STREAM) as server:
+        server.bind(address)
+        server.listen(1)
+        connection, _ = server.accept()
+        with connection:
+            while True:
+                block = connection.recv(block_bytes)
+                if not block:
+                    return
+                yield block
+
+def pcm_frames(byte_chunks, frame_seconds: float = FRAME_SECONDS):
+    """
+    Regroups arbitrary byte chunks of 16-bit PCM into float32 frames of frame_seconds.
+    """
+    frame_bytes = int(SAMPLE_RATE * frame_seconds) * BYTES_PER_SAMPLE
+    buffer = b""
+    for chunk in byte_chunks:
+        buffer += chunk
+        while len(buffer) >= frame_bytes:
+            frame, buffer = buffer[:frame_bytes], buffer[frame_bytes:]
+            yield np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768.0
+
+def vad_segments(frames, energy_ratio: float = 3.0, min_energy: float = 1e-3, min_silence_seconds: float = 0.6, max_segment_seconds: float = 25.0, padding_seconds: float = 0.2):
+    """
+    Energy based voice activity detection. A frame is speech when its RMS is above both min_energy
+    and energy_ratio times the running noise floor. A segment is closed after min_silence_seconds
+    of silence, or when it reaches max_segment_seconds, so Whisper always sees a bounded window.
+    Yields:
+        tuple: (start_seconds, samples) per speech segment.
+    """
+    padding_frames = int(padding_seconds / FRAME_SECONDS)
+    silence_frames_to_close = int(min_silence_seconds / FRAME_SECONDS)
+    max_segment_frames = int(max_segment_seconds / FRAME_SECONDS)
+    noise_floor = min_energy
+    history, segment = [], []
+    segment_start, silent_frames = 0, 0
+    for index, frame in enumerate(frames):
+        rms = float(np.sqrt(np.mean(frame ** 2)))
+        is_speech = rms > max(min_energy, energy_ratio * noise_floor)
+        if not is_speech:
+            noise_floor = 0.95 * noise_floor + 0.05 * rms
+        if segment:
+            segment.append(frame)
+            silent_frames = 0 if is_speech else silent_frames + 1
+            if silent_frames >= silence_frames_to_close or len(segment) >= max_segment_frames:
+                yield segment_start * FRAME_SECONDS, np.concatenate(segment)
+                segment, silent_frames = [], 0
+        elif is_speech:
+            segment = history[-padding_frames:] + [frame] if padding_frames else [frame]
+            segment_start = index + 1 - len(segment)
+        history = (history + [frame])[-padding_frames:] if padding_frames else []
+    if segment:
+        yield segment_start * FRAME_SECONDS, np.concatenate(segment)
+
+def stream_transcribe(byte_chunks, model, **vad_options):
+    """
+    Transcribes a live recording window by window. Each VAD segment goes through Whisper as soon
+    as it is closed, with the text so far as the prompt for continuity.
+    Args:
+        byte_chunks: Iterable of raw 16 kHz mono 16-bit PCM bytes, e.g. follow_file or socket_source.
+        model: Loaded Whisper model.
+    Yields:
+        dict: {"start", "end", "text"} per transcribed segment, times in seconds from the start of the recording.
+    """
+    previous_text = ""
+    for start, samples in vad_segments(pcm_frames(byte_chunks), **vad_options):
+        result = model.transcribe(samples, fp16=False, initial_prompt=previous_text[-200:] or None)
+        text = result["text"].strip()
+        if text:
+            previous_text = f"{previous_text} {text}".strip()
+            yield {"start": start, "end": start + len(samples) / SAMPLE_RATE, "text": text}
+
+def iter_sentences(segments):
+    """
+    Regroups streamed segments into complete sentences, so downstream chunking can start on
+    finished sentences before the recording ends. The unfinished remainder is yielded last.
+    """
+    buffer = ""
+    for segment in segments:
+        buffer = f"{buffer} {segment['text']}".strip()
+        *sentences, buffer = re.split(r'(?<=[.!?])\s+', buffer)
+        for sentence in sentences:
+            yield sentence
+    if buffer:
+        yield buffer
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe raw 16 kHz mono 16-bit PCM while it is being recorded.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="PCM file being appended to, e.g. by: ffmpeg -i <input> -f s16le -ac 1 -ar 16000 <file>")
+    source.add_argument("--socket", help="Unix socket path to receive PCM on.")
+    parser.add_argument("--model", default="base")
+    args = parser.parse_args()
+
+    from src.audio_processing.transcriber import load_model
+    model = load_model(args.model)
+    byte_chunks = follow_file(args.file) if args.file else socket_source(args.socket)
+    for segment in stream_transcribe(byte_chunks, model):
+        print(f"[{segment['start']:7.2f} - {segment['end']:7.2f}] {segment['text']}", flush=True)
+
+if __name__ == "__main__":
+    main()
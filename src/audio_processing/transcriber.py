@@ -1,33 +1,41 @@
 # transcriber.py
-from openai import OpenAI
-import whisper
 import os
+import numpy as np
+from src.audio_processing.audio_cache import load_samples
+from src.audio_processing.backends import load_backend
 
-def load_model(model_name: str = "large"):
+def load_model(model_name: str = "large", backend: str = None):
     """
     Load the Whisper model for transcription.
     Args:
         model_name (str): The model variant to load ('tiny', 'base', 'small', 'medium', 'large').
+        backend (str): Transcription backend, defaults to the TRANSCRIPTION_BACKEND environment variable.
     Returns:
-        model: The Whisper model object.
+        TranscriptionBackend: The loaded model.
     """
     print(f"Loading Whisper model: {model_name}...")
-    model = whisper.load_model(model_name)
+    model = load_backend(model_name, backend)
     print("Model loaded successfully.")
     return model
 
-def transcribe_audio(file_path: str, model):
+def transcribe_audio(file_path, model):
     """
     Transcribe an audio file to text using the Whisper model.
     Args:
-        file_path (str): Path to the audio file.
+        file_path: Path to the audio file, decoded through the audio cache, or 16 kHz mono float32
+            samples already in memory.
         model: Loaded Whisper model.
     Returns:
         str: The transcribed text.
     """
-    print(f"Transcribing audio file: {file_path}...")
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Audio file not found: {file_path}")
+    if isinstance(file_path, np.ndarray):
+        print(f"Transcribing {len(file_path) / 16000:.1f}s of in-memory audio...")
+    else:
+        print(f"Transcribing audio file: {file_path}...")
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Audio file not found: {file_path}")
+        # Whisper hands the array to torch, which expects a writable buffer.
+        file_path = np.array(load_samples(file_path))
 
     result = model.transcribe(file_path)
     text = result["text"]
@@ -0,0 +1,143 @@
+# transcription_server.py
+import os
+import json
+import queue
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.audio_processing.backends import TRANSCRIPTION_BACKEND
+
+DEFAULT_SERVER_URL = os.getenv("TRANSCRIPTION_SERVER_URL", "http://127.0.0.1:8765")
+
+class TranscriptionWorker():
+    """
+    Keeps Whisper models resident and transcribes queued jobs one at a time, in arrival order.
+    """
+    def __init__(self, preload=(), backend: str = None):
+        self.backend = backend or TRANSCRIPTION_BACKEND
+        self.models = {}
+        self.jobs = queue.Queue()
+        for model_name in preload:
+            self.get_model(model_name)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_model(self, model_name: str):
+        if model_name not in self.models:
+            from src.audio_processing.transcriber import load_model
+            self.models[model_name] = load_model(model_name, self.backend)
+        return self.models[model_name]
+
+    def submit(self, audio_path: str, model_name: str, clean: bool = False) -> Future:
+        future = Future()
+        self.jobs.put((audio_path, model_name, clean, future))
+        return future
+
+    def run(self):
+        from src.audio_processing.transcriber import transcribe_audio
+        while True:
+            audio_path, model_name, clean, future = self.jobs.get()
+            try:
+                if clean:
+                    from src.audio_processing.audio_cleaning import clean_audio
+                    audio_path = clean_audio(audio_path)
+                future.set_result(transcribe_audio(audio_path, self.get_model(model_name)))
+            except Exception as e:
+                future.set_exception(e)
+
+class TranscriptionRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status: int, body: dict):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        self.send_json(200, {"status": "ok", "backend": self.server.worker.backend, "models": list(self.server.worker.models), "queued": self.server.worker.jobs.qsize()})
+
+    def do_POST(self):
+        if self.path != "/transcribe":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            audio_path = os.path.abspath(request["audio_path"])
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_json(400, {"error": f"Malformed transcription request: {e!r}", "type": type(e).__name__})
+        future = self.server.worker.submit(audio_path, request.get("model", "large"), request.get("clean", False))
+        try:
+            self.send_json(200, {"text": future.result(), "backend": self.server.worker.backend})
+        except FileNotFoundError as e:
+            self.send_json(404, {"error": str(e), "type": "FileNotFoundError"})
+        except Exception as e:
+            self.send_json(500, {"error": str(e), "type": type(e).__name__})
+
+class TranscriptionClient():
+    """
+    Submits transcription jobs to a running transcription server.
+    """
+    def __init__(self, url: str = DEFAULT_SERVER_URL, timeout: float = 3600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def health(self):
+        """
+        The server's /health report, including the transcription backend it runs, None when it is not reachable.
+        """
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=1) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError):
+            return None
+
+    def is_alive(self) -> bool:
+        return self.health() is not None
+
+    def transcribe(self, audio_path: str, model_name: str = "large", clean: bool = False) -> str:
+        """
+        Transcribe an audio file on the server.
+        Args:
+            audio_path (str): Path to the audio file, readable by the server.
+            model_name (str): Whisper model variant to use.
+            clean (bool): Denoise the audio in memory before transcribing it.
+        Returns:
+            str: The transcribed text.
+        """
+        request = urllib.request.Request(
+            f"{self.url}/transcribe",
+            data=json.dumps({"audio_path": os.path.abspath(audio_path), "model": model_name, "clean": clean}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())["text"]
+        except urllib.error.HTTPError as e:
+            error = json.loads(e.read())
+            if error.get("type") == "FileNotFoundError":
+                raise FileNotFoundError(error["error"]) from None
+            raise RuntimeError(f"Transcription server error: {error['error']}") from None
+
+def serve(host: str = "127.0.0.1", port: int = 8765, preload=("large",), backend: str = None):
+    server = ThreadingHTTPServer((host, port), TranscriptionRequestHandler)
+    server.worker = TranscriptionWorker(preload, backend)
+    print(f"Transcription server listening on http://{host}:{port} with the {server.worker.backend} backend")
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local transcription server that keeps Whisper models loaded.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--preload", nargs="*", default=["large"], help="Models to load at startup.")
+    parser.add_argument("--backend", default=TRANSCRIPTION_BACKEND, help="Transcription backend, defaults to the TRANSCRIPTION_BACKEND environment variable.")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.preload, args.backend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# batch.py
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from src.main import get_output_folders, get_next_transcription_file_name, find_matching_transcription_file_name, transcribe_note, chunk_and_fill_note
+from src.audio_processing.transcriber import load_model, save_transcription
+from src.audio_processing.transcription_server import TranscriptionClient
+from src.text_processing.process_form import load_form_index
+from src.metrics.compare import compare
+from src.form_filling.response_cache import get_response_cache
+from utils.stage_cache import get_stage_cache
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.ogg')
+
+def list_audio_files(source: str) -> list:
+    """
+    Lists the audio files to process from a directory, or from a manifest: a .json list of paths
+    or a text file with one path per line.
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, file) for file in os.listdir(source) if file.lower().endswith(AUDIO_EXTENSIONS))
+    with open(source, 'r') as file:
+        if source.endswith('.json'):
+            return json.load(file)
+        return [line.strip() for line in file if line.strip()]
+
+def chunk_fill_and_compare(transcribed_text, folders, saved_files_base_name, form_dataframe, cache=None, response_cache=None) -> dict:
+    t = time.time()
+    note = chunk_and_fill_note(transcribed_text, folders, saved_files_base_name, form_dataframe, cache, response_cache)
+    result = {
+        "chunks_file_path": note["chunks_file_path"],
+        "filled_form_file_path": note["filled_form_file_path"],
+        "number_of_filled_rows": len(note["filled_rows"]),
+        "failed_rows": note["failed_rows"],
+        "telemetry": note["telemetry"],
+        "chunk_and_fill_seconds": time.time() - t,
+    }
+    try:
+        result["filled_forms_comparison"] = compare(note["filled_form_file_path"], "filled_forms")
+    except (OSError, ValueError) as e:
+        result["filled_forms_comparison_error"] = str(e)
+    return result
+
+def run_batch(audio_file_paths: list, model_name: str = "large", max_parallel_notes: int = 4, clean: bool = False) -> list:
+    """
+    Processes recordings unattended. Transcription runs in this thread one file at a time, and as
+    soon as a transcript is saved its chunking and form filling, which are network bound, start on
+    a thread pool, so they overlap with the transcription of the next file.
+    Returns:
+        list: One summary dict per audio file, in input order.
+    """
+    form_dataframe = load_form_index("./form.json")
+    transcription_client = TranscriptionClient()
+    model = None if transcription_client.is_alive() else load_model(model_name)
+    cache = get_stage_cache()
+    response_cache = get_response_cache()
+
+    summaries, futures = [], []
+    with ThreadPoolExecutor(max_workers=max_parallel_notes) as executor:
+        for audio_file_path in audio_file_paths:
+            summary = {"audio_file_path": audio_file_path}
+            summaries.append(summary)
+            futures.append(None)
+            try:
+                folders = get_output_folders(audio_file_path)
+                t = time.time()
+                transcribed_text = transcribe_note(audio_file_path, model_name, transcription_client, model, cache, clean)
+                summary["transcription_seconds"] = time.time() - t
+                saved_files_base_name = find_matching_transcription_file_name(audio_file_path, folders["transcriptions"], transcribed_text) or get_next_transcription_file_name(audio_file_path, folders["transcriptions"])
+                summary["transcription_file_path"] = os.path.join(folders["transcriptions"], f"{saved_files_base_name}.txt")
+                save_transcription(transcribed_text, summary["transcription_file_path"])
+            except Exception as e:
+                summary["error"] = f"transcription failed: {e}"
+                continue
+            try:
+                summary["transcription_similarity"] = compare(summary["transcription_file_path"], "transcriptions")
+            except (OSError, ValueError) as e:
+                summary["transcription_comparison_error"] = str(e)
+            futures[-1] = executor.submit(chunk_fill_and_compare, transcribed_text, folders, saved_files_base_name, form_dataframe, cache, response_cache)
+
+        for summary, future in zip(summaries, futures):
+            if future is None:
+                continue
+            try:
+                summary.update(future.result())
+            except Exception as e:
+                summary["error"] = f"chunking or form filling failed: {e}"
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the whole pipeline over a directory or manifest of recordings.")
+    parser.add_argument("source", help="Directory of audio files, or a manifest (.json list or one path per line).")
+    parser.add_argument("--model", default="large", help="Whisper model variant.")
+    parser.add_argument("--max-parallel-notes", type=int, default=4, help="Notes chunked and filled at the same time.")
+    parser.add_argument("--clean", action="store_true", help="Denoise the audio in memory before transcribing it.")
+    parser.add_argument("--summary", help="Where to write the batch summary JSON.")
+    args = parser.parse_args()
+
+    audio_file_paths = list_audio_files(args.source)
+    if not audio_file_paths:
+        print(f"No audio files found in {args.source}")
+        return
+    t = time.time()
+    summaries = run_batch(audio_file_paths, args.model, args.max_parallel_notes, args.clean)
+    summary_path = args.summary or os.path.join(get_output_folders(audio_file_paths[0])["root"], f"batch_summary_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(summary_path, 'w') as file:
+        json.dump({"total_seconds": time.time() - t, "notes": summaries}, file, indent=4, default=str)
+    failed = sum("error" in summary for summary in summaries)
+    print(f"Processed {len(summaries) - failed} of {len(summaries)} recordings in {time.time() - t:.1f}s, summary saved to {summary_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# batch_api.py
+import os
+import json
+import glob
+import time
+import argparse
+from types import SimpleNamespace
+
+from openai import OpenAI
+
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import FILL_MODEL, prepare_rows, build_row_request, parse_row_answer, assemble_filled_rows, save_filled_form
+from src.form_filling.response_models import get_registry
+from src.form_filling.response_cache import get_response_cache
+from src.form_filling.rules import get_rule_engine
+from utils.llm_client import StubBatchClient
+from utils.stage_cache import hash_parts
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# The Batch API accepts up to 50,000 requests per input file.
+BATCH_MAX_REQUESTS = 50_000
+BATCH_FOLDER = os.getenv("BATCH_FOLDER", "./data/batches")
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", 60))
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def get_batch_client():
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def list_chunk_files(sources: list) -> list:
+    """
+    Expands chunk files and folders of chunk files (data/*/chunks) into a sorted list of .json paths.
+    """
+    paths = []
+    for source in sources:
+        paths += sorted(glob.glob(os.path.join(source, "*.json"))) if os.path.isdir(source) else [source]
+    return paths
+
+def filled_form_path(chunks_file_path: str) -> str:
+    """
+    data/<root>/chunks/<note>.json is filled into data/<root>/filled_forms/<note>.json, as in main.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(chunks_file_path)))
+    return os.path.join(root, "filled_forms", os.path.basename(chunks_file_path))
+
+def build_batch(notes: dict, form_dataframe, registry=None, mode: str = "row", response_cache=None, retrieval_index=None, rule_engine=None):
+    """
+    Builds the Batch API requests of every row to fill for several notes. Rows answered by rules or
+    the response cache get no request.
+    Args:
+        notes (dict): Note name to chunked output.
+        mode (str): "row" or "prefix" prompt layout, one request per row either way.
+    Returns:
+        tuple: (list of request lines, dict of note name to its rows in form order, each with the
+            row name, options and response cache key, and either the custom_id of its request or its
+            (row_name, answer) pair)
+    """
+    if mode not in ("row", "prefix"):
+        raise ValueError(f"Batch jobs send one request per row, mode must be row or prefix, not {mode!r}")
+    registry = registry or get_registry()
+    requests, planned_notes = [], {}
+    for note_name, chunked_output in notes.items():
+        rows, answers, cache_keys, pending = prepare_rows(form_dataframe, chunked_output, mode, response_cache, None, retrieval_index, rule_engine)
+        planned_rows = [{"row_name": row["row_name"], "options": row["options"], "cache_key": cache_key, "answer": list(answer), "custom_id": None} for row, answer, cache_key in zip(rows, answers, cache_keys)]
+        for position in pending:
+            request = build_row_request(rows[position], chunked_output, registry, mode)
+            if request is None:
+                continue
+            messages, response_format = request
+            planned_rows[position]["custom_id"] = f"{note_name}::{position}"
+            requests.append({"custom_id": planned_rows[position]["custom_id"], "method": "POST", "url": BATCH_ENDPOINT, "body": {"model": FILL_MODEL, "messages": messages, "response_format": response_format}})
+        planned_notes[note_name] = planned_rows
+    registry.save()
+    if len(requests) > BATCH_MAX_REQUESTS:
+        raise ValueError(f"{len(requests)} requests exceed the {BATCH_MAX_REQUESTS} allowed per batch, submit fewer notes at once")
+    return requests, planned_notes
+
+def write_batch_file(requests: list, path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        for request in requests:
+            file.write(json.dumps(request) + "\n")
+
+def submit_batch(client, input_path: str, metadata: dict = None) -> str:
+    """
+    Uploads a JSONL request file and creates a batch on the chat completions endpoint.
+    Returns:
+        str: The batch id.
+    """
+    with open(input_path, 'rb') as file:
+        input_file = client.files.create(file=file, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=BATCH_COMPLETION_WINDOW, metadata=metadata)
+    return batch.id
+
+def wait_for_batch(client, batch_id: str, poll_seconds: float = BATCH_POLL_SECONDS, timeout: float = None):
+    """
+    Polls a batch until it completes, fails, expires or is cancelled.
+    Returns:
+        The last retrieved batch, or None when timeout seconds passed first.
+    """
+    t = time.time()
+    status = None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status != status:
+            status = batch.status
+            print(f"Batch {batch_id} is {status}")
+        if status in TERMINAL_STATUSES:
+            return batch
+        if timeout is not None and time.time() - t > timeout:
+            return None
+        time.sleep(poll_seconds)
+
+def read_batch_results(client, batch) -> dict:
+    """
+    Reads the output and error files of a batch.
+    Returns:
+        dict: custom_id to result line, for every request the batch answered or failed.
+    """
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            for line in client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["custom_id"]] = result
+    return results
+
+def result_message(result):
+    """
+    The assistant message of a successful result line, None for failed requests.
+    """
+    result = result or {}
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    message = response["body"]["choices"][0]["message"]
+    return SimpleNamespace(content=message.get("content"), refusal=message.get("refusal"))
+
+def collect_filled_forms(planned_notes: dict, results: dict, mode: str = "row", response_cache=None):
+    """
+    Maps batch results back to each note's rows and assembles the filled forms. Successful answers,
+    filled or not, are stored in the response cache, failed requests are left unfilled.
+    Returns:
+        tuple: (dict of note name to filled rows, number of failed or missing requests)
+    """
+    filled_forms, number_of_failed = {}, 0
+    for note_name, planned_rows in planned_notes.items():
+        answers = []
+        for row in planned_rows:
+            if row["custom_id"] is None:
+                answers.append(tuple(row["answer"]))
+                continue
+            message = result_message(results.get(row["custom_id"]))
+            if message is None:
+                number_of_failed += 1
+                answers.append((None, None))
+                continue
+            row_name, answer = parse_row_answer(row, message, mode)
+            answers.append((row_name, answer))
+            if response_cache is not None and row["cache_key"]:
+                response_cache.put(row["cache_key"], row_name, answer)
+        filled_forms[note_name] = assemble_filled_rows(answers)
+    return filled_forms, number_of_failed
+
+def submit_backfill(chunks_file_paths: list, client, form_dataframe, mode: str = "row", folder: str = BATCH_FOLDER, response_cache=None, rule_engine=None, retrieval_index=None) -> str:
+    """
+    Writes the requests of every note to one JSONL job file, submits it and saves a manifest of the
+    job next to it, so the results can be collected by a later process.
+    Returns:
+        str: Path of the job manifest, or None when every row was answered without a request.
+    """
+    notes = {}
+    for chunks_file_path in chunks_file_paths:
+        with open(chunks_file_path, 'r') as file:
+            notes[chunks_file_path] = json.load(file)
+    requests, planned_notes = build_batch(notes, form_dataframe, mode=mode, response_cache=response_cache, retrieval_index=retrieval_index, rule_engine=rule_engine)
+    job_name = f"backfill_{time.strftime('%Y%m%d_%H%M%S')}_{hash_parts(list(notes), requests)[:8]}"
+    manifest = {"mode": mode, "batch_id": None, "notes": {note_name: {"filled_form_path": filled_form_path(note_name), "rows": rows} for note_name, rows in planned_notes.items()}}
+    manifest_path = os.path.join(folder, f"{job_name}.json")
+    if requests:
+        input_path = os.path.join(folder, f"{job_name}.jsonl")
+        write_batch_file(requests, input_path)
+        manifest["batch_id"] = submit_batch(client, input_path, {"job": job_name})
+        print(f"Submitted {len(requests)} requests for {len(notes)} notes as batch {manifest['batch_id']}")
+    os.makedirs(folder, exist_ok=True)
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest_path
+
+def finish_backfill(manifest_path: str, client, poll_seconds: float = BATCH_POLL_SECONDS, timeout: float = None, response_cache=None) -> dict:
+    """
+    Waits for the batch of a job manifest and saves each note's filled form.
+    Returns:
+        dict: Note name to filled rows, None when the batch did not finish within timeout seconds.
+    """
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    results = {}
+    if manifest["batch_id"]:
+        batch = wait_for_batch(client, manifest["batch_id"], poll_seconds, timeout)
+        if batch is None:
+            return None
+        results = read_batch_results(client, batch)
+    planned_notes = {note_name: note["rows"] for note_name, note in manifest["notes"].items()}
+    filled_forms, number_of_failed = collect_filled_forms(planned_notes, results, manifest["mode"], response_cache)
+    for note_name, filled_rows in filled_forms.items():
+        os.makedirs(os.path.dirname(manifest["notes"][note_name]["filled_form_path"]), exist_ok=True)
+        save_filled_form(filled_rows, manifest["notes"][note_name]["filled_form_path"])
+    if number_of_failed:
+        print(f"{number_of_failed} requests failed or were not answered, their rows are left unfilled")
+    return filled_forms
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the forms of already chunked notes through the Batch API, for backfills that do not need interactive latency.")
+    parser.add_argument("chunks", nargs="*", help="Chunk files or folders of chunk files, e.g. data/trials/chunks.")
+    parser.add_argument("--resume", help="Manifest of a submitted job to collect instead of submitting a new one.")
+    parser.add_argument("--mode", default="row", choices=["row", "prefix"], help="Prompt layout of the row requests.")
+    parser.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS)
+    parser.add_argument("--submit-only", action="store_true", help="Submit and exit, collect later with --resume.")
+    parser.add_argument("--stub", action="store_true", help="Answer the batch locally with the stand-in responder, in this process only.")
+    args = parser.parse_args()
+
+    client = StubBatchClient() if args.stub else get_batch_client()
+    response_cache = get_response_cache()
+    manifest_path = args.resume
+    if manifest_path is None:
+        chunks_file_paths = list_chunk_files(args.chunks)
+        if not chunks_file_paths:
+            print("No chunk files given")
+            return
+        manifest_path = submit_backfill(chunks_file_paths, client, load_form_index("./form.json"), args.mode, response_cache=response_cache, rule_engine=get_rule_engine())
+        print(f"Job manifest saved to {manifest_path}")
+        if args.submit_only:
+            return
+    finish_backfill(manifest_path, client, args.poll_seconds, response_cache=response_cache)
+
+if __name__ == "__main__":
+    main()
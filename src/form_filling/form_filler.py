@@ -1,19 +1,21 @@
 # form_filler.py
-import os
-import re
 import time
 import json 
+import asyncio
 
-from openai import OpenAI
-from enum import Enum
-from pydantic import BaseModel, create_model
-from typing import Optional
 from tqdm import tqdm
 
 import import_ipynb
+from utils.llm_client import get_async_client, acreate_completion
+from utils.stage_cache import hash_parts
+from src.form_filling.response_models import CANNOT_FILL, get_registry, group_field_names, row_key
+from src.form_filling.response_cache import canonicalize_relevant_information
+from src.text_processing.process_form import filled_row_name
 
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+FILL_MODEL = "gpt-4o-2024-08-06"
+DEFAULT_CONCURRENCY = 16
+# Strict structured outputs allow 100 object properties per schema and each row uses 3.
+DEFAULT_ROWS_PER_REQUEST = 20
 
 system_prompt = "You are an medical expert in the assessment_placeholder assessment. You will be given an unstructured medical information and you can try to honestly extract information about a specific line-item in assessment_placeholder assessment. It is completely alright to not fill in any information, if unsure or unclear."
 
@@ -32,79 +34,456 @@ If unsure or unclear, choose "Line item cannot be filled with the provided infor
 def find_relevant_rows(form_dataframe, assessment_name):
     return form_dataframe[assessment_name.lower() in form_dataframe['assessment_names'].str.lower()]
 
-def fill_row(row, chunked_output):
+
+group_system_prompt = "You are an medical expert in the assessment_placeholder assessment. You will be given an unstructured medical information and you can try to honestly extract information about several line-items in assessment_placeholder assessment. It is completely alright to not fill in any information, if unsure or unclear."
+
+group_user_prompt = """For each of the following line items of the 'group_name_placeholder' subgroup of a larger form, with respect to the assessment_placeholder assessment, use the following structured information to fill in the values: "chunk_information_placeholder". Answer every line item under its own name."""
+
+group_assistant_prompt = """The following information about each line item can help you fill it in
+
+line_items_placeholder
+
+If the information for a line item is not explicitly clear choose, "Line item cannot be filled with the provided information".
+If unsure or unclear, choose "Line item cannot be filled with the provided information".
+"""
+
+line_item_prompt = """- 'field_name_placeholder':
+    1. row_information_placeholder
+    2. additional_notes_placeholder"""
+
+# Prefix layout: everything shared by the calls of a note (instructions, then the note's chunk
+# information) comes first and only the last message is specific to the row, so the provider can
+# serve most of each prompt from its prompt cache.
+prefix_system_prompt = """You are an medical expert in nursing assessments. You will be given structured information extracted from an unstructured nurse summary, one entry per body system assessment, and then asked about a single line-item of a larger form. Honestly extract the value of that line-item from the information for its assessment only. It is completely alright to not fill in any information, if unsure or unclear.
+
+Answer with one of the options listed for the line item, copied exactly. If the information is not explicitly clear, or if unsure or unclear, set line_item_cannot_be_filled_with_the_provided_information and choose "Line item cannot be filled with the provided information"."""
+
+prefix_information_prompt = 'Structured information from the nurse summary, per body system assessment: "chunk_information_placeholder"'
+
+prefix_row_prompt = """For line item 'row_name_placeholder' of the 'group_name_placeholder' subgroup, with respect to the assessment_placeholder assessment, fill in the value.
+The following information about the line item can help you fill it in
+
+1. row_information_placeholder
+2. additional_notes_placeholder
+
+Options: options_placeholder"""
+
+PROMPT_VERSION = hash_parts(system_prompt, user_prompt, assistant_prompt)
+GROUP_PROMPT_VERSION = hash_parts(group_system_prompt, group_user_prompt, group_assistant_prompt, line_item_prompt)
+PREFIX_PROMPT_VERSION = hash_parts(prefix_system_prompt, prefix_information_prompt, prefix_row_prompt)
+
+
+def get_referred_assessments(chunked_output) -> set:
+    """
+    Returns the body systems that the chunker found referred to in the summary.
+    """
+    return {assessment_name for assessment_name, chunk in chunked_output.items() if chunk and chunk.get('is_referred_to_in_summary')}
+
+def select_candidate_rows(form_dataframe, chunked_output):
+    """
+    Keeps only the rows with at least one assessment referred to in the summary, so rows that
+    fill_row would discard never get a prompt, a response model or a scheduled call.
+    Args:
+        form_dataframe (pd.DataFrame): Flattened form from process_json_file.
+        chunked_output (dict): Output of chunk_transcription.
+    Returns:
+        pd.DataFrame: The candidate rows, in form order.
+    """
+    referred_assessments = get_referred_assessments(chunked_output)
+    body_system_rows = form_dataframe.attrs.get('body_system_rows')
+    if body_system_rows is not None:
+        candidate_labels = set().union(*(body_system_rows.get(assessment_name, ()) for assessment_name in referred_assessments))
+        return form_dataframe[form_dataframe.index.isin(candidate_labels)]
+    is_candidate = form_dataframe['assessment_names'].apply(lambda assessment_names: not referred_assessments.isdisjoint(assessment_names))
+    return form_dataframe[is_candidate]
+
+def get_relevant_information(row, chunked_output):
+    """
+    Selects the chunker output for the body systems of a row that are referred to in the summary.
+    Returns:
+        tuple: (list of relevant assessment names, dict of their chunk information)
+    """
+    referred_assessments = get_referred_assessments(chunked_output)
+    relevant_assessments = [assessment_name for assessment_name in row["assessment_names"] if assessment_name in referred_assessments]
+    relevant_information = {assessment_name: chunked_output[assessment_name] for assessment_name in relevant_assessments}
+    return relevant_assessments, relevant_information
+
+def build_messages(row, relevant_assessments, relevant_information):
+    """
+    Fills the prompt templates for a row.
+    Returns:
+        list: The chat messages to send for this row.
+    """
+    relevant_assessments = ' '.join(relevant_assessments)
+    group_name : str = row["group_name"]
+    row_name : str = row["row_name"]
+    row_information : str = row["row_information"]
+    additional_notes : str = row["additional_notes"]
+    return [
+        {"role": "system", "content": system_prompt.replace("assessment_placeholder", relevant_assessments)},
+        {"role": "user", "content": user_prompt.replace("assessment_placeholder", relevant_assessments).replace("row_name_placeholder", row_name).replace("chunk_information_placeholder", str(relevant_information)).replace("group_name_placeholder", group_name)},
+        {"role": "assistant", "content": assistant_prompt.replace("row_information_placeholder", row_information).replace("additional_notes_placeholder", additional_notes)}
+    ]
+
+def get_note_information(chunked_output) -> dict:
+    """
+    The chunk information of every referred body system, in a fixed order, shared by all rows of a note.
+    """
+    return {assessment_name: chunked_output[assessment_name] for assessment_name in sorted(get_referred_assessments(chunked_output))}
+
+def build_prefix_messages(row, relevant_assessments, note_information):
+    """
+    Fills the prefix layout templates for a row: the instructions and the note's information form
+    a prefix shared by every row of the note, and the row's own content comes last.
+    Returns:
+        list: The chat messages to send for this row.
+    """
+    options = '; '.join(f'"{option}"' for option in row["options"]) or "free text"
+    return [
+        {"role": "system", "content": prefix_system_prompt},
+        {"role": "user", "content": prefix_information_prompt.replace("chunk_information_placeholder", json.dumps(note_information))},
+        {"role": "user", "content": prefix_row_prompt.replace("row_name_placeholder", row["row_name"]).replace("group_name_placeholder", row["group_name"]).replace("assessment_placeholder", ' '.join(relevant_assessments)).replace("row_information_placeholder", row["row_information"] or "").replace("additional_notes_placeholder", row["additional_notes"] or "").replace("options_placeholder", options)}
+    ]
+
+def build_group_messages(rows, relevant_assessments, relevant_information):
+    """
+    Fills the multi-row prompt templates for rows of the same group.
+    Returns:
+        list: The chat messages to send for these rows.
+    """
+    relevant_assessments = ' '.join(relevant_assessments)
+    line_items = '\n'.join(
+        line_item_prompt.replace("field_name_placeholder", field_name).replace("row_information_placeholder", row["row_information"]).replace("additional_notes_placeholder", row["additional_notes"])
+        for field_name, row in zip(group_field_names(rows), rows)
+    )
+    return [
+        {"role": "system", "content": group_system_prompt.replace("assessment_placeholder", relevant_assessments)},
+        {"role": "user", "content": group_user_prompt.replace("assessment_placeholder", relevant_assessments).replace("chunk_information_placeholder", str(relevant_information)).replace("group_name_placeholder", rows[0]["group_name"])},
+        {"role": "assistant", "content": group_assistant_prompt.replace("line_items_placeholder", line_items)}
+    ]
+
+def split_into_group_batches(rows, rows_per_request: int) -> list:
+    """
+    Splits rows, in form order, into batches of consecutive rows from the same group with at
+    most rows_per_request rows each.
+    """
+    batches = []
+    for row in rows:
+        if batches and len(batches[-1]) < rows_per_request and (batches[-1][0]["template_id"], batches[-1][0]["group_id"]) == (row["template_id"], row["group_id"]):
+            batches[-1].append(row)
+        else:
+            batches.append([row])
+    return batches
+
+def number_of_tokens_used(completion) -> int:
+    return getattr(getattr(completion, "usage", None), "total_tokens", 0) or 0
+
+def parse_answer(row_name, message):
+    """
+    Turns the structured output message into the (row_name, value) pair that goes into the filled form.
+    """
+    if not message or getattr(message, "refusal", None) or not message.content:
+        return None, None
+    return parse_entry(row_name, json.loads(message.content))
+
+def parse_entry(row_name, answer):
+    """
+    Turns one row's answer object into the (row_name, value) pair that goes into the filled form.
+    """
+    if not answer:
+        return None, None
+    entry = answer.get("line_item_entry_if_sufficient_information")
+    if answer.get("line_item_cannot_be_filled_with_the_provided_information") or not entry or entry == CANNOT_FILL:
+        return None, None
+    return row_name, entry
+
+def build_row_request(row, chunked_output, registry, mode: str = "row"):
+    """
+    The messages and response_format of a single row request, in the "row" or "prefix" layout.
+    Returns:
+        tuple: (messages, response_format), None when none of the row's assessments are referred to.
+    """
+    relevant_assessments, relevant_information = get_relevant_information(row, chunked_output)
+    if not relevant_assessments:
+        return None
+    if mode == "prefix":
+        return build_prefix_messages(row, relevant_assessments, get_note_information(chunked_output)), registry.get_open_response_format()
+    return build_messages(row, relevant_assessments, relevant_information), registry.get_response_format(row)
+
+def parse_row_answer(row, message, mode: str = "row"):
+    """
+    parse_answer for a single row request. Free text answers of the "prefix" layout must be one of the row's options.
+    """
+    row_name, value = parse_answer(row["row_name"], message)
+    if mode == "prefix" and row_name is not None and row["options"] and value not in row["options"]:
+        return None, None
+    return row_name, value
+
+def fill_row(row, chunked_output, registry=None, async_client=None):
+    """
+    Fills a single row synchronously.
+    Returns:
+        tuple: (row_name, answer, number_of_tokens_called), (None, None, 0) when the row is not filled or errored.
+    """
+    async def fill():
+        return await afill_row(row, chunked_output, async_client or get_async_client(), asyncio.Semaphore(1), registry or get_registry())
     try:
-        relevant_assessments = [assessment_name for assessment_name in row["assessment_names"] if chunked_output[assessment_name]['is_referred_to_in_summary']]
-        if relevant_assessments:
-            relevant_information = {assessment_name: chunked_output[assessment_name] for assessment_name in relevant_assessments}
-            relevant_assessments = ' '.join(relevant_assessments)
-            group_name : str = row["group_name"]
-            row_name : str = row["row_name"]
-            row_information : str = row["row_information"]
-            additional_notes : str = row["additional_notes"]
-            options : dict = {string.replace('"', ''): string.replace('"', '') for string in row["options"]}
-            options["Line item cannot be filled with the provided information"] = "Line item cannot be filled with the provided information"
-            if options:
-                Options_class = Enum('Options',options)
-                Response_class = create_model(
-                    'Response',
-                    line_item_cannot_be_filled_with_the_provided_information=(bool, ...),
-                    line_item_entry_if_sufficient_information=(Options_class, ...)
-                )
-                Response_class.model_rebuild()
-            else:
-                Response_class = create_model(
-                    'Response',
-                    line_item_cannot_be_filled_with_the_provided_information=(bool, ...),
-                    line_item_entry_if_sufficient_information=(Optional[str], None)
-                )
-            try:
-                answer = client.beta.chat.completions.parse(
-                        model="gpt-4o-2024-08-06",
-                        messages=[
-                            {"role": "system", "content": system_prompt.replace("assessment_placeholder", relevant_assessments)},
-                            {"role": "user", "content": user_prompt.replace("assessment_placeholder", relevant_assessments).replace("row_name_placeholder", row_name).replace("chunk_information_placeholder", str(relevant_information)).replace("group_name_placeholder", group_name)},
-                            {"role": "assistant", "content": assistant_prompt.replace("row_information_placeholder", row_information).replace("additional_notes_placeholder", additional_notes)}
-                        ],
-                        response_format=Response_class
-                    ).choices[0].message.parsed
-                number_of_tokens_called = (4/3)*len(f"""
-                    {system_prompt.replace("assessment_placeholder", relevant_assessments)} 
-                    {user_prompt.replace("assessment_placeholder", relevant_assessments).replace("row_name_placeholder", row_name).replace("chunk_information_placeholder", str(relevant_information))} {assistant_prompt.replace("row_information_placeholder", row_information).replace("additional_notes_placeholder", additional_notes)}
-                                            """.split())
-                if answer:
-                    answer = answer.__dict__
-                else:
-                    return None, None, 0
-            except:
-                print(f"This {row_name} errored. Try to figure why?")
-                return None, None, 0
-            
-            if answer["line_item_cannot_be_filled_with_the_provided_information"] or not answer["line_item_entry_if_sufficient_information"] or answer["line_item_entry_if_sufficient_information"].value=="Line item cannot be filled with the provided information":
-                return None, None, 0
-            else:
-                return row_name, answer["line_item_entry_if_sufficient_information"].value, number_of_tokens_called
-            
+        return asyncio.run(fill())
+    except Exception as e:
+        print(f"{row['row_name']} errored: {e}")
         return None, None, 0
-    except:
+
+async def afill_row(row, chunked_output, async_client, semaphore, registry, max_retries: int = 5, telemetry=None):
+    """
+    Async counterpart of fill_row. Rate limits and transient errors are retried with backoff
+    while holding a concurrency slot, so retries do not pile up extra in-flight requests.
+    Errors that remain after the retries are raised.
+    Returns:
+        tuple: (row_name, answer, number_of_tokens_called), (None, None, 0) when the row is not filled.
+    """
+    request = build_row_request(row, chunked_output, registry)
+    if request is None:
         return None, None, 0
+    messages, response_format = request
+    async with semaphore:
+        completion = await acreate_completion(async_client, FILL_MODEL, messages, response_format, max_retries, telemetry, "form_filling", row["group_name"], row["row_name"])
+    row_name, value = parse_row_answer(row, completion.choices[0].message)
+    return row_name, value, number_of_tokens_used(completion)
+
+async def afill_row_prefix(row, chunked_output, async_client, semaphore, registry, max_retries: int = 5, telemetry=None):
+    """
+    Fills a row with the prefix layout. Every row uses the same free text response format, because
+    the schema precedes the messages in the cached prefix, and the answer is checked against the
+    row's options instead.
+    Errors that remain after the retries are raised.
+    Returns:
+        tuple: (row_name, answer, number_of_tokens_called), (None, None, 0) when the row is not filled.
+    """
+    request = build_row_request(row, chunked_output, registry, "prefix")
+    if request is None:
+        return None, None, 0
+    messages, response_format = request
+    async with semaphore:
+        completion = await acreate_completion(async_client, FILL_MODEL, messages, response_format, max_retries, telemetry, "form_filling", row["group_name"], row["row_name"])
+    row_name, value = parse_row_answer(row, completion.choices[0].message, "prefix")
+    return row_name, value, number_of_tokens_used(completion)
+
+async def afill_group(rows, chunked_output, async_client, semaphore, registry, max_retries: int = 5, telemetry=None):
+    """
+    Fills rows of one group with a single structured output request.
+    Errors that remain after the retries are raised.
+    Returns:
+        tuple: (list of (row_name, answer) per row, in row order, number_of_tokens_called)
+    """
+    unfilled = [(None, None)] * len(rows)
+    relevant_assessments, relevant_information = get_relevant_information(rows[0], chunked_output)
+    if not relevant_assessments:
+        return unfilled, 0
+    response_format = registry.get_group_response_format(rows)
+    messages = build_group_messages(rows, relevant_assessments, relevant_information)
+    async with semaphore:
+        completion = await acreate_completion(async_client, FILL_MODEL, messages, response_format, max_retries, telemetry, "form_filling", rows[0]["group_name"], f"{len(rows)} rows")
+    message = completion.choices[0].message
+    if getattr(message, "refusal", None) or not message.content:
+        return unfilled, number_of_tokens_used(completion)
+    answers = json.loads(message.content)
+    filled = [parse_entry(row["row_name"], answers.get(field_name)) for field_name, row in zip(group_field_names(rows), rows)]
+    return filled, number_of_tokens_used(completion)
+
+async def afill_batch(rows, chunked_output, async_client, semaphore, registry, max_retries: int = 5, mode: str = "row", telemetry=None):
+    """
+    Fills a batch of rows, one row in "row" and "prefix" modes, rows of one group in "group" mode.
+    Returns:
+        tuple: (list of (row_name, answer) per row, number_of_tokens_called, error message or None)
+    """
+    try:
+        if mode == "group":
+            filled, number_of_tokens_called = await afill_group(rows, chunked_output, async_client, semaphore, registry, max_retries, telemetry)
+        elif mode == "prefix":
+            row_name, answer, number_of_tokens_called = await afill_row_prefix(rows[0], chunked_output, async_client, semaphore, registry, max_retries, telemetry)
+            filled = [(row_name, answer)]
+        else:
+            row_name, answer, number_of_tokens_called = await afill_row(rows[0], chunked_output, async_client, semaphore, registry, max_retries, telemetry)
+            filled = [(row_name, answer)]
+        return filled, number_of_tokens_called, None
+    except Exception as e:
+        print(f"{', '.join(row['row_name'] for row in rows)} errored: {e}")
+        return [(None, None)] * len(rows), 0, f"{type(e).__name__}: {e}"
+
+def row_answer_cache_key(row, chunked_output, mode: str) -> str:
+    """
+    Hash of everything a row's answer depends on: the row id and content, the model, the prompt
+    templates of the fill mode and the canonicalised chunk information the prompt contains, that of
+    the row's referred assessments, or of the whole note in "prefix" mode.
+    """
+    if mode == "prefix":
+        relevant_information = get_note_information(chunked_output)
+    else:
+        _, relevant_information = get_relevant_information(row, chunked_output)
+    row_content = {field: row[field] for field in ("group_name", "row_name", "row_information", "additional_notes", "options")}
+    prompt_version = {"group": GROUP_PROMPT_VERSION, "prefix": PREFIX_PROMPT_VERSION}.get(mode, PROMPT_VERSION)
+    return hash_parts(row_key(row), row_content, FILL_MODEL, prompt_version, canonicalize_relevant_information(relevant_information))
 
-            
-def fill_form_from_chunks(form_dataframe, chunked_output):
+def prepare_rows(form_dataframe, chunked_output, mode: str = "row", response_cache=None, telemetry=None, retrieval_index=None, rule_engine=None, journal=None):
+    """
+    Selects the rows to fill and answers those that need no request, from rules, the journal of an
+    earlier interrupted run or the response cache.
+    Returns:
+        tuple: (candidate rows as dicts in form order, (row_name, answer) per row, response cache key
+            per row, positions of the rows still to be sent)
+    """
+    candidate_rows = select_candidate_rows(form_dataframe, chunked_output)
+    print(f"{len(candidate_rows)} of {len(form_dataframe)} rows belong to body systems referred to in the summary")
+    if retrieval_index is not None:
+        candidate_rows = retrieval_index.shortlist(candidate_rows, chunked_output)
+        print(f"{len(candidate_rows)} rows retrieved for the exceptions text")
+    rows = candidate_rows.to_dict('records')
+
+    answers = [(None, None)] * len(rows)
+    cache_keys = [None] * len(rows)
+    pending = []
+    number_of_rule_rows, number_of_journaled_rows = 0, 0
+    for position, row in enumerate(rows):
+        ruled = rule_engine.answer(row, chunked_output) if rule_engine is not None else None
+        if ruled is not None:
+            answers[position] = ruled
+            number_of_rule_rows += 1
+            continue
+        if response_cache is not None or journal is not None:
+            cache_keys[position] = row_answer_cache_key(row, chunked_output, mode)
+        journaled = journal.get(cache_keys[position]) if journal is not None else None
+        if journaled is not None:
+            answers[position] = (journaled["row_name"], journaled["answer"])
+            number_of_journaled_rows += 1
+            continue
+        if response_cache is not None:
+            cached = response_cache.get(cache_keys[position])
+            if cached is not None:
+                answers[position] = (cached["row_name"], cached["answer"])
+                if telemetry is not None:
+                    telemetry.record("form_filling", row["group_name"], row["row_name"], FILL_MODEL, cache_hit=True)
+                continue
+        pending.append(position)
+    if rule_engine is not None:
+        print(f"{number_of_rule_rows} rows filled by rules")
+    if journal is not None:
+        print(f"{number_of_journaled_rows} rows resumed from the journal")
+    if response_cache is not None:
+        print(f"{len(rows) - len(pending) - number_of_rule_rows - number_of_journaled_rows} rows answered from the cache")
+    return rows, answers, cache_keys, pending
+
+def assemble_filled_rows(answers) -> dict:
+    """
+    Builds the filled form from (row_name, answer) pairs in form order, so rows whose names collide
+    after removing the '[id]' suffix resolve exactly as they do in the sequential loop.
+    """
     filled_rows = {}
-    assessment_names = [i for i,v in chunked_output.items()]
-    total_number_of_tokens_called = 0
-    t = time.time()
-    for index, row in tqdm(form_dataframe.iterrows()):
-        row_name, answer, number_of_tokens_called = fill_row(row, chunked_output)
-        total_number_of_tokens_called += number_of_tokens_called
+    for row_name, answer in answers:
         if row_name and answer:
-            filled_rows[re.sub(r'\[\d+\]', '', row_name).strip()] = answer
-        if index % 100 == 0:
-            print(f"Total tokens used = {total_number_of_tokens_called} \n Avarage tokens per call = {total_number_of_tokens_called/(index+1)}")
-            print(f"Total time {time.time()-t} for {index+1} rows \n Avarage time per call = {(time.time()-t)/(index+1)}")
+            filled_rows[filled_row_name(row_name)] = answer
     return filled_rows
 
+def next_wave(rows, answers, remaining: set) -> list:
+    """
+    Rows sharing a filled name overwrite each other and the last filled one in form order is kept.
+    For every name, selects the last row still to be sent, unless a later row of that name is
+    already filled, so earlier duplicates are only sent when the rows after them came back unfilled.
+    Returns:
+        list: Positions to send, in form order.
+    """
+    positions_by_name = {}
+    for position, row in enumerate(rows):
+        positions_by_name.setdefault(filled_row_name(row["row_name"]), []).append(position)
+    wave = []
+    for positions in positions_by_name.values():
+        for position in reversed(positions):
+            if position in remaining:
+                wave.append(position)
+                break
+            if answers[position][1]:
+                break
+    return sorted(wave)
+
+async def afill_form_from_chunks(form_dataframe, chunked_output, async_client=None, concurrency: int = DEFAULT_CONCURRENCY, max_retries: int = 5, registry=None, mode: str = "row", rows_per_request: int = DEFAULT_ROWS_PER_REQUEST, response_cache=None, telemetry=None, retrieval_index=None, rule_engine=None, journal=None):
+    """
+    Fills the candidate rows of the form concurrently, with at most `concurrency` requests in flight.
+
+    Results are assembled in form order, so rows whose names collide after removing the
+    '[id]' suffix resolve exactly as they do in the sequential loop.
+    Args:
+        form_dataframe (pd.DataFrame): Flattened form from process_json_file.
+        chunked_output (dict): Output of chunk_transcription.
+        async_client (AsyncOpenAI): Client to use, defaults to the one selected by LLM_CLIENT_MODE.
+        concurrency (int): Maximum number of requests in flight.
+        max_retries (int): Retries per row for rate limit and transient errors.
+        registry (ResponseModelRegistry): Source of the rows' response formats, defaults to the shared registry.
+        mode (str): "row" sends one request per row, "group" asks about up to rows_per_request rows
+            of the same group in one request, "prefix" sends one request per row laid out so that
+            all requests of the note share a prompt prefix, which bills more than "row" unless the
+            note is long (see src.metrics.prefix_reuse).
+        rows_per_request (int): Row budget of a request in "group" mode.
+        response_cache (ResponseCache): Cache of per-row answers. Rows with a cached answer are not
+            sent and successful answers, filled or not, are stored.
+        telemetry (Telemetry): Records usage, latency and retries of every call and the cache hits.
+        retrieval_index (RetrievalIndex): When given, only the rows and options it retrieves for the
+            body systems' exceptions text are sent.
+        rule_engine (RuleEngine): When given, rows it has a rule for are filled from the chunker
+            output and not sent.
+        journal (FillJournal): Checkpoint of the note. Every answer and failure is appended as its
+            request completes, and rows it holds an answer for are not sent again.
+    Returns:
+        dict: Row name to filled value.
+    """
+    async_client = async_client or get_async_client()
+    registry = registry or get_registry()
+    semaphore = asyncio.Semaphore(concurrency)
+    t = time.time()
+    rows, answers, cache_keys, pending = prepare_rows(form_dataframe, chunked_output, mode, response_cache, telemetry, retrieval_index, rule_engine, journal)
+
+    remaining = set(pending)
+    failed_rows = []
+    total_number_of_tokens_called, number_of_requests = 0, 0
+    while True:
+        wave = next_wave(rows, answers, remaining)
+        if not wave:
+            break
+        remaining.difference_update(wave)
+        if mode == "group":
+            batches = split_into_group_batches([dict(rows[position], position=position) for position in wave], rows_per_request)
+        else:
+            batches = [[dict(rows[position], position=position)] for position in wave]
+
+        async def fill_and_checkpoint(batch):
+            # Answers are stored as soon as their request completes, so a crash loses no finished call.
+            filled, number_of_tokens_called, error = await afill_batch(batch, chunked_output, async_client, semaphore, registry, max_retries, mode, telemetry)
+            for row, (row_name, answer) in zip(batch, filled):
+                answers[row["position"]] = (row_name, answer)
+                if error:
+                    failed_rows.append(row["row_name"])
+                elif response_cache is not None:
+                    response_cache.put(cache_keys[row["position"]], row_name, answer)
+                if journal is not None:
+                    journal.record(cache_keys[row["position"]], row["row_name"] if error else row_name, answer, error)
+            return number_of_tokens_called
+
+        tasks = [asyncio.ensure_future(fill_and_checkpoint(batch)) for batch in batches]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            total_number_of_tokens_called += await task
+        number_of_requests += len(tasks)
+    registry.save()
+    if remaining:
+        print(f"{len(remaining)} rows not sent, a later row with the same name was filled")
+    if failed_rows:
+        print(f"{len(failed_rows)} rows failed and are left unfilled{', they are retried when the journal is resumed' if journal is not None else ''}: {', '.join(failed_rows)}")
+
+    filled_rows = assemble_filled_rows(answers)
+    print(f"Total tokens used = {total_number_of_tokens_called} \n Average tokens per call = {total_number_of_tokens_called/max(number_of_requests, 1)}")
+    print(f"Total time {time.time()-t} for {len(rows)} rows in {number_of_requests} requests with concurrency {concurrency}")
+    return filled_rows
+
+def fill_form_from_chunks(form_dataframe, chunked_output, concurrency: int = DEFAULT_CONCURRENCY, async_client=None, mode: str = "row", rows_per_request: int = DEFAULT_ROWS_PER_REQUEST, response_cache=None, telemetry=None, retrieval_index=None, rule_engine=None, journal=None):
+    return asyncio.run(afill_form_from_chunks(form_dataframe, chunked_output, async_client=async_client, concurrency=concurrency, mode=mode, rows_per_request=rows_per_request, response_cache=response_cache, telemetry=telemetry, retrieval_index=retrieval_index, rule_engine=rule_engine, journal=journal))
+
 def save_filled_form(filled_form:dict, json_file_path: str):
     with open(json_file_path, 'w') as file:
         json.dump(filled_form, file, indent=4)
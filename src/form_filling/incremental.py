@@ -0,0 +1,118 @@
+# incremental.py
+import os
+import json
+import asyncio
+import argparse
+
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import afill_form_from_chunks, save_filled_form
+from src.form_filling.response_cache import canonicalize_relevant_information, get_response_cache
+from src.form_filling.rules import get_rule_engine
+from src.form_filling.batch_api import filled_form_path
+
+# Opt-in for src.main: reusing an earlier filled form is only safe while the prompts, rules and form
+# templates it was filled with are unchanged, which is not checked.
+INCREMENTAL_REFILL = os.getenv("INCREMENTAL_REFILL", "0") == "1"
+
+def changed_systems(previous_chunked_output, chunked_output) -> set:
+    """
+    Body systems whose canonicalised chunk information differs between two chunker outputs. A
+    system missing from one of them, e.g. because its chunker call failed, counts as not referred to.
+    """
+    changed = set()
+    for assessment_name in set(previous_chunked_output or {}) | set(chunked_output or {}):
+        previous_chunk = canonicalize_relevant_information({assessment_name: (previous_chunked_output or {}).get(assessment_name) or {}})
+        chunk = canonicalize_relevant_information({assessment_name: (chunked_output or {}).get(assessment_name) or {}})
+        if previous_chunk != chunk:
+            changed.add(assessment_name)
+    return changed
+
+def rows_to_refill(form_dataframe, changed: set, mode: str = "row"):
+    """
+    Rows whose answer can depend on the changed systems: those with an assessment among them, and
+    every row sharing a filled name with one of those, since they overwrite each other in the filled
+    form. In "prefix" mode every prompt holds the whole note, so any change refills every row.
+    Returns:
+        pd.DataFrame: The rows to fill again, in form order.
+    """
+    if not changed:
+        return form_dataframe.iloc[:0]
+    if mode == "prefix":
+        return form_dataframe
+    is_affected = form_dataframe['assessment_names'].apply(lambda assessment_names: not changed.isdisjoint(assessment_names))
+    affected_names = set(form_dataframe.loc[is_affected, 'filled_name'])
+    return form_dataframe[form_dataframe['filled_name'].isin(affected_names)]
+
+def merge_filled_rows(form_dataframe, previous_filled_rows: dict, refilled_rows: dict, refilled_names: set) -> dict:
+    """
+    Replaces the values of the refilled names in the previous filled form, dropping those that are
+    no longer filled, and keeps the other values. Names are ordered as in the form.
+    """
+    merged = {}
+    for filled_name in dict.fromkeys(form_dataframe['filled_name']):
+        filled_rows = refilled_rows if filled_name in refilled_names else previous_filled_rows
+        if filled_name in filled_rows:
+            merged[filled_name] = filled_rows[filled_name]
+    for filled_name, value in previous_filled_rows.items():
+        if filled_name not in merged and filled_name not in refilled_names:
+            merged[filled_name] = value
+    return merged
+
+async def arefill_form(form_dataframe, previous_chunked_output, previous_filled_rows: dict, chunked_output, mode: str = "row", **fill_options):
+    """
+    Fills the form for a new chunker output of a note that was filled before, sending only the rows
+    that depend on the body systems whose information changed and merging them into the previous
+    filled form.
+    Args:
+        previous_chunked_output (dict): Chunker output the previous filled form was filled from.
+        previous_filled_rows (dict): The previous filled form.
+        chunked_output (dict): The new chunker output.
+        fill_options: Passed on to afill_form_from_chunks.
+    Returns:
+        tuple: (merged filled rows, set of changed body systems)
+    """
+    changed = changed_systems(previous_chunked_output, chunked_output)
+    refill_rows = rows_to_refill(form_dataframe, changed, mode)
+    print(f"Changed body systems: {sorted(changed) or 'none'}, {len(refill_rows)} of {len(form_dataframe)} rows to refill")
+    if refill_rows.empty:
+        return dict(previous_filled_rows), changed
+    refilled_rows = await afill_form_from_chunks(refill_rows, chunked_output, mode=mode, **fill_options)
+    return merge_filled_rows(form_dataframe, previous_filled_rows, refilled_rows, set(refill_rows['filled_name'])), changed
+
+def refill_form(form_dataframe, previous_chunked_output, previous_filled_rows: dict, chunked_output, mode: str = "row", **fill_options):
+    return asyncio.run(arefill_form(form_dataframe, previous_chunked_output, previous_filled_rows, chunked_output, mode, **fill_options))
+
+def load_previous_note(chunks_file_path: str):
+    """
+    Loads the chunker output saved at chunks_file_path and the filled form saved next to it.
+    Returns:
+        tuple: (chunked output, filled rows), None when either file is missing.
+    """
+    form_path = filled_form_path(chunks_file_path)
+    if not (os.path.exists(chunks_file_path) and os.path.exists(form_path)):
+        return None
+    with open(chunks_file_path, 'r') as file:
+        previous_chunked_output = json.load(file)
+    with open(form_path, 'r') as file:
+        previous_filled_rows = json.load(file)
+    return previous_chunked_output, previous_filled_rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Refill a note's form from new chunks, sending only the rows of the body systems that changed.")
+    parser.add_argument("chunks", help="New chunk file, its filled form is written to the filled_forms folder next to it.")
+    parser.add_argument("--previous", required=True, help="Chunk file the note was filled from before, with its filled form next to it.")
+    args = parser.parse_args()
+
+    previous_note = load_previous_note(args.previous)
+    if previous_note is None:
+        print(f"No chunks or filled form saved for {args.previous}")
+        return
+    with open(args.chunks, 'r') as file:
+        chunked_output = json.load(file)
+    filled_rows, _ = refill_form(load_form_index("./form.json"), *previous_note, chunked_output, response_cache=get_response_cache(), rule_engine=get_rule_engine())
+    form_path = filled_form_path(args.chunks)
+    os.makedirs(os.path.dirname(form_path), exist_ok=True)
+    save_filled_form(filled_rows, form_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# journal.py
+import os
+import json
+import time
+import threading
+
+class FillJournal():
+    """
+    Append-only JSONL journal of a note's row answers, one line per row as soon as its request
+    completes, keyed like the response cache by everything the answer depends on. An interrupted
+    fill resumes from it without repeating finished calls, and rows whose request failed are
+    journaled as failed and sent again on the next run.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        # Insertion ordered, so failures are reported in the order they happened.
+        self.recorded_keys = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash, the row is sent again.
+                        continue
+                    self.entries[entry["key"]] = entry
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a')
+        if self.file.tell() and not self.ends_with_newline():
+            # Terminate the cut-short line so the next entry starts on a line of its own.
+            self.file.write("\n")
+            self.file.flush()
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def get(self, key: str):
+        """
+        Returns the journaled {"row_name", "answer"} for key, None when the row has not completed or failed last.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry["error"]:
+            return None
+        return entry
+
+    def record(self, key: str, row_name: str, answer: str, error: str = None):
+        entry = {"key": key, "time": time.time(), "row_name": row_name, "answer": answer, "error": error}
+        with self.lock:
+            self.entries[key] = entry
+            self.recorded_keys[key] = None
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def failed(self) -> list:
+        """
+        Entries of the rows whose request failed since the journal was opened, to be retried. Failures
+        from earlier runs that this run did not send again, e.g. because their chunks changed, are left out.
+        """
+        with self.lock:
+            return [self.entries[key] for key in self.recorded_keys if self.entries[key]["error"]]
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,98 @@
+# response_cache.py
+import os
+import re
+import time
+import sqlite3
+import threading
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./data/response_cache.sqlite")
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 200_000))
+# Eviction scans the table, so it runs once per this many writes rather than on every write.
+EVICTION_INTERVAL = 500
+
+EMPTY_EXCEPTIONS = {"", "none", "null", "n/a", "na", "false", "no exceptions", "wdl"}
+
+def canonicalize_exceptions(exceptions):
+    """
+    Normalises the free text the chunker returns for a body system, so that notes saying the same
+    thing ("None", "", None, "No exceptions.") produce the same cache key.
+    """
+    if exceptions is None or exceptions is False:
+        return None
+    text = re.sub(r'\s+', ' ', str(exceptions)).strip().lower().rstrip('.')
+    return None if text in EMPTY_EXCEPTIONS else text
+
+def canonicalize_relevant_information(relevant_information: dict) -> dict:
+    return {
+        assessment_name: {
+            "is_referred_to_in_summary": bool(chunk.get("is_referred_to_in_summary")),
+            "exceptions_to_within_defined_limits": canonicalize_exceptions(chunk.get("exceptions_to_within_defined_limits")),
+        }
+        for assessment_name, chunk in sorted(relevant_information.items())
+    }
+
+class ResponseCache():
+    """
+    Persistent SQLite cache of row answers. Entries expire ttl_seconds after they were written and
+    the least recently used entries are dropped beyond max_entries.
+    """
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.puts_since_eviction = 0
+        self.lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, row_name TEXT, answer TEXT, created_at REAL, last_used_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used_at ON responses (last_used_at)")
+            self.evict()
+
+    def get(self, key: str):
+        """
+        Returns the cached {"row_name", "answer"} for key, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            entry = self.connection.execute("SELECT row_name, answer, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if entry is None:
+                return None
+            row_name, answer, created_at = entry
+            if now - created_at > self.ttl_seconds:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+        return {"row_name": row_name, "answer": answer}
+
+    def put(self, key: str, row_name, answer):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, row_name, answer, now, now))
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction >= EVICTION_INTERVAL:
+                self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries and the least recently used ones beyond max_entries.
+        Callers hold the lock and the transaction.
+        """
+        self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self.connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.puts_since_eviction = 0
+
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,215 @@
+# response_models.py
+import os
+import re
+import json
+import hashlib
+import threading
+
+from enum import Enum
+from pydantic import create_model
+from typing import Optional
+
+RESPONSE_SCHEMAS_PATH = "./data/response_schemas.json"
+
+CANNOT_FILL = "Line item cannot be filled with the provided information"
+
+def row_key(row) -> str:
+    """
+    Stable identifier of a form row. Row ids are only unique within their group and template.
+    """
+    return f"{row['template_id']}:{row['group_id']}:{row['row_id']}"
+
+def options_hash(options) -> str:
+    return hashlib.sha256(json.dumps(list(options)).encode()).hexdigest()[:16]
+
+def build_response_class(row):
+    """
+    Creates the structured output model for a row, with its options as an Enum.
+    """
+    options : dict = {string.replace('"', ''): string.replace('"', '') for string in row["options"]}
+    options[CANNOT_FILL] = CANNOT_FILL
+    if options:
+        Options_class = Enum('Options',options)
+        Response_class = create_model(
+            'Response',
+            line_item_cannot_be_filled_with_the_provided_information=(bool, ...),
+            line_item_entry_if_sufficient_information=(Options_class, ...)
+        )
+        Response_class.model_rebuild()
+    else:
+        Response_class = create_model(
+            'Response',
+            line_item_cannot_be_filled_with_the_provided_information=(bool, ...),
+            line_item_entry_if_sufficient_information=(Optional[str], None)
+        )
+    return Response_class
+
+def strict_schema(schema, root=None):
+    """
+    Rewrites a pydantic JSON schema in place into the strict subset structured outputs accept: every
+    object closed and all of its properties required, None defaults dropped, and $refs that carry
+    other keys inlined.
+    """
+    root = schema if root is None else root
+    for definition in schema.get("$defs", {}).values():
+        strict_schema(definition, root)
+    if schema.get("type") == "object" and "additionalProperties" not in schema:
+        schema["additionalProperties"] = False
+    if "properties" in schema:
+        schema["required"] = list(schema["properties"])
+        schema["properties"] = {name: strict_schema(value, root) for name, value in schema["properties"].items()}
+    if isinstance(schema.get("items"), dict):
+        schema["items"] = strict_schema(schema["items"], root)
+    if "anyOf" in schema:
+        schema["anyOf"] = [strict_schema(variant, root) for variant in schema["anyOf"]]
+    if len(schema.get("allOf", [])) == 1:
+        schema.update(strict_schema(schema.pop("allOf")[0], root))
+    elif "allOf" in schema:
+        schema["allOf"] = [strict_schema(entry, root) for entry in schema["allOf"]]
+    if "default" in schema and schema["default"] is None:
+        schema.pop("default")
+    if "$ref" in schema and len(schema) > 1:
+        resolved = root
+        for part in schema["$ref"][2:].split("/"):
+            resolved = resolved[part]
+        schema.update({**resolved, **schema})
+        schema.pop("$ref")
+    return schema
+
+def strict_response_format(model) -> dict:
+    """
+    The json_schema response_format for a pydantic model, built from its own model_json_schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": strict_schema(model.model_json_schema()),
+            "name": model.__name__,
+            "strict": True,
+        },
+    }
+
+def group_field_names(rows) -> list:
+    """
+    Property names of the rows in a multi-row response: the row names without their '[id]' suffix.
+    """
+    field_names = []
+    for row in rows:
+        field_name = re.sub(r'\[\d+\]', '', row["row_name"]).strip()
+        while field_name in field_names:
+            field_name = f"{field_name} (repeated)"
+        field_names.append(field_name)
+    return field_names
+
+def inline_row_schema(schema: dict) -> dict:
+    """
+    Resolves the Options $ref of a row schema so it can be nested inside a multi-row schema.
+    """
+    properties = {}
+    for name, property_schema in schema["properties"].items():
+        if "$ref" in property_schema:
+            property_schema = schema["$defs"][property_schema["$ref"].split("/")[-1]]
+        properties[name] = {key: value for key, value in property_schema.items() if key != "title"}
+    return {"type": "object", "properties": properties, "required": schema["required"], "additionalProperties": False}
+
+class ResponseModelRegistry():
+    """
+    Response models and their strict JSON schema response_format, keyed by row key and options hash.
+
+    Models are built at most once per process. The response_format dicts, which are all a request
+    needs, are persisted to disk so other processes and later notes skip model and schema generation.
+    Notes filled on different threads share the registry, so lookups and saves hold its lock.
+    """
+    def __init__(self, path: str = RESPONSE_SCHEMAS_PATH):
+        self.path = path
+        self.models = {}
+        self.response_formats = {}
+        self.is_dirty = False
+        # Reentrant: group formats are built from row formats.
+        self.lock = threading.RLock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as file:
+                self.response_formats = json.load(file)
+
+    def key(self, row) -> str:
+        return f"{row_key(row)}:{options_hash(row['options'])}"
+
+    def get_model(self, row):
+        key = self.key(row)
+        with self.lock:
+            if key not in self.models:
+                self.models[key] = build_response_class(row)
+            return self.models[key]
+
+    def get_response_format(self, row) -> dict:
+        key = self.key(row)
+        with self.lock:
+            if key not in self.response_formats:
+                self.response_formats[key] = strict_response_format(self.get_model(row))
+                self.is_dirty = True
+            return self.response_formats[key]
+
+    def get_open_response_format(self) -> dict:
+        """
+        Strict response_format shared by every row in the prefix layout: the answer is free text and
+        the row's options are listed in the prompt.
+        """
+        with self.lock:
+            if "open" not in self.response_formats:
+                Response_class = create_model(
+                    'Response',
+                    line_item_cannot_be_filled_with_the_provided_information=(bool, ...),
+                    line_item_entry_if_sufficient_information=(Optional[str], ...)
+                )
+                self.response_formats["open"] = strict_response_format(Response_class)
+                self.is_dirty = True
+            return self.response_formats["open"]
+
+    def get_group_response_format(self, rows) -> dict:
+        """
+        Strict response_format answering several rows at once, one nested object per row keyed by
+        group_field_names, built from the rows' own schemas.
+        """
+        key = "group:" + hashlib.sha256(" ".join(self.key(row) for row in rows).encode()).hexdigest()[:16]
+        with self.lock:
+            if key not in self.response_formats:
+                properties = {
+                    field_name: inline_row_schema(self.get_response_format(row)["json_schema"]["schema"])
+                    for field_name, row in zip(group_field_names(rows), rows)
+                }
+                self.response_formats[key] = {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "GroupResponse",
+                        "strict": True,
+                        "schema": {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False},
+                    },
+                }
+                self.is_dirty = True
+            return self.response_formats[key]
+
+    def save(self):
+        """
+        Writes newly generated schemas to disk, if any. The lock is held until the file is replaced,
+        so a save never overwrites a later one with an older snapshot.
+        """
+        with self.lock:
+            if not (self.path and self.is_dirty):
+                return
+            response_formats = dict(self.response_formats)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(response_formats, file)
+            os.replace(tmp_path, self.path)
+            self.is_dirty = False
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ResponseModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ResponseModelRegistry()
+    return _registry
@@ -0,0 +1,67 @@
+# retrieval.py
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from src.form_filling.response_cache import canonicalize_exceptions
+
+DEFAULT_TOP_K_ROWS = 25
+DEFAULT_TOP_K_OPTIONS = 8
+
+def row_document(row) -> str:
+    return ' '.join(str(part) for part in [row["group_name"], row["row_name"], row["row_information"], row["additional_notes"], *row["options"]] if part)
+
+class RetrievalIndex():
+    """
+    Local TF-IDF index over the form's rows (group, name, information, notes and options) and their
+    options. Given the chunker output, it keeps for each referred body system only the top_k_rows
+    rows that share vocabulary with its exceptions text, and for rows with long option lists only
+    the top_k_options options closest to that text. Rows with no overlap get no LLM call.
+    """
+    def __init__(self, form_dataframe, top_k_rows: int = DEFAULT_TOP_K_ROWS, top_k_options: int = DEFAULT_TOP_K_OPTIONS):
+        self.top_k_rows = top_k_rows
+        self.top_k_options = top_k_options
+        documents = [row_document(row) for row in form_dataframe.to_dict('records')]
+        self.vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True)
+        self.vectorizer.fit(documents + [option for options in form_dataframe['options'] for option in options])
+        self.row_vectors = dict(zip(form_dataframe.index, self.vectorizer.transform(documents)))
+
+    def queries(self, chunked_output) -> dict:
+        """
+        TF-IDF vector of the exceptions text of each referred body system that has one.
+        """
+        texts = {
+            assessment_name: canonicalize_exceptions(chunk.get('exceptions_to_within_defined_limits'))
+            for assessment_name, chunk in chunked_output.items() if chunk and chunk.get('is_referred_to_in_summary')
+        }
+        return {assessment_name: self.vectorizer.transform([text]) for assessment_name, text in texts.items() if text}
+
+    def shortlist_options(self, options, query):
+        if len(options) <= self.top_k_options:
+            return options
+        scores = (self.vectorizer.transform(options) @ query.T).toarray().ravel()
+        if not scores.any():
+            return options
+        keep = set(np.argsort(-scores, kind='stable')[:self.top_k_options])
+        return [option for position, option in enumerate(options) if position in keep]
+
+    def shortlist(self, candidate_rows, chunked_output):
+        """
+        Args:
+            candidate_rows (pd.DataFrame): Rows of the referred body systems, from select_candidate_rows.
+            chunked_output (dict): Output of chunk_transcription.
+        Returns:
+            pd.DataFrame: The retrieved rows, in form order, with their options shortlisted.
+        """
+        queries = self.queries(chunked_output)
+        kept = {}
+        for assessment_name, query in queries.items():
+            labels = [label for label, assessment_names in candidate_rows['assessment_names'].items() if assessment_name in assessment_names]
+            scores = [(self.row_vectors[label] @ query.T).toarray()[0, 0] for label in labels]
+            ranked = sorted((score, -position, label) for position, (label, score) in enumerate(zip(labels, scores)) if score > 0)
+            for _, _, label in ranked[::-1][:self.top_k_rows]:
+                kept.setdefault(label, []).append(query)
+        shortlisted_rows = candidate_rows[candidate_rows.index.isin(kept)].copy()
+        shortlisted_rows['options'] = [
+            self.shortlist_options(options, sum(kept[label][1:], kept[label][0]))
+            for label, options in shortlisted_rows['options'].items()
+        ]
+        return shortlisted_rows
@@ -0,0 +1,65 @@
+# rules.py
+import re
+import json
+from src.form_filling.response_cache import canonicalize_exceptions
+
+FILL_RULES_PATH = "./utils/fill_rules.json"
+
+def rule_row_key(template_name: str, group_name: str, row_name: str) -> tuple:
+    return (template_name.strip(), group_name.strip(), re.sub(r'\[\d+\]', '', row_name).strip())
+
+class RuleEngine():
+    """
+    Fills mechanical rows, such as the body system WDL rows, straight from the chunker output,
+    ahead of the LLM. Rules are declared per template, group and row in utils/fill_rules.json.
+    """
+    def __init__(self, rules: list):
+        self.rules = {rule_row_key(rule["template"], rule["group"], rule["row"]): rule for rule in rules}
+
+    @classmethod
+    def from_file(cls, path: str = FILL_RULES_PATH):
+        with open(path, 'r') as file:
+            return cls(json.load(file)["rules"])
+
+    def rule_for(self, row):
+        return self.rules.get(rule_row_key(row["template_name"], row["group_name"], row["row_name"]))
+
+    def answer(self, row, chunked_output):
+        """
+        Returns:
+            tuple: (row_name, answer) when a rule applies to the row, (None, None) when it applies and
+                leaves the row unfilled, None when no rule applies and the row goes to the model.
+        """
+        rule = self.rule_for(row)
+        chunk = chunked_output.get(rule["assessment"]) if rule else None
+        if not chunk or not chunk.get('is_referred_to_in_summary'):
+            return None
+        has_exceptions = canonicalize_exceptions(chunk.get('exceptions_to_within_defined_limits')) is not None
+        value = rule["if_exceptions"] if has_exceptions else rule["if_within_defined_limits"]
+        return (row["row_name"], value) if value else (None, None)
+
+    def validate(self, form_dataframe) -> list:
+        """
+        Returns the problems with the rules against the form: rules that match no row and rule
+        values that are not options of their row.
+        """
+        problems = []
+        matched = set()
+        for row in form_dataframe.to_dict('records'):
+            rule = self.rule_for(row)
+            if rule is None:
+                continue
+            matched.add(rule_row_key(rule["template"], rule["group"], rule["row"]))
+            for value in (rule["if_exceptions"], rule["if_within_defined_limits"]):
+                if value and value not in row["options"]:
+                    problems.append(f"{rule['row']}: {value!r} is not an option")
+        problems += [f"{key[2]}: no row in {key[0]} / {key[1]}" for key in self.rules if key not in matched]
+        return problems
+
+_rule_engine = None
+
+def get_rule_engine() -> RuleEngine:
+    global _rule_engine
+    if _rule_engine is None:
+        _rule_engine = RuleEngine.from_file()
+    return _rule_engine
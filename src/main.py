@@ -1,12 +1,20 @@
 # main.py
 
 import os
-from src.audio_processing.audio_cleaning import reduce_noise
+from src.audio_processing.audio_cleaning import clean_audio
+from src.audio_processing.backends import TRANSCRIPTION_BACKEND
 from src.audio_processing.transcriber import load_model, transcribe_audio, save_transcription
+from src.audio_processing.transcription_server import TranscriptionClient
 from src.text_processing.chunker import chunk_transcription, save_chunks
-from src.text_processing.process_form import process_json_file
+from src.text_processing.process_form import load_form_index
 from src.form_filling.form_filler import fill_form_from_chunks, save_filled_form
+from src.form_filling.response_cache import get_response_cache
+from src.form_filling.rules import get_rule_engine
+from src.form_filling.incremental import INCREMENTAL_REFILL, load_previous_note, refill_form
+from src.form_filling.journal import FillJournal
 from src.metrics.compare import compare
+from utils.stage_cache import get_stage_cache, hash_parts, file_hash
+from utils.telemetry import Telemetry
 
 def get_next_transcription_file_name(audio_file_path, transcriptions_folder) -> str:
     """
@@ -37,60 +45,154 @@ def get_next_transcription_file_name(audio_file_path, transcriptions_folder) ->
     # Return the next file name in the format '{basename}_{existing_index+1}'
     return f"{basename}_{existing_index + 1}"
 
-def main():
-    audio_file_path = input("Enter the path to the audio file: ").strip().strip("'")
-    if not os.path.exists(audio_file_path):
-        print(f"Error: The file '{audio_file_path}' does not exist.")
-        return
+def find_matching_transcription_file_name(audio_file_path, transcriptions_folder, transcribed_text):
+    """
+    Returns the base name of the latest saved transcription of this audio file if its text is
+    identical to transcribed_text, so a cached re-run does not write a new numbered copy.
+    """
+    basename = os.path.splitext(os.path.basename(audio_file_path))[0]
+    latest_index = int(get_next_transcription_file_name(audio_file_path, transcriptions_folder).split('_')[-1]) - 1
+    latest_file_path = os.path.join(transcriptions_folder, f"{basename}_{latest_index}.txt")
+    if os.path.exists(latest_file_path):
+        with open(latest_file_path, 'r') as file:
+            if file.read() == transcribed_text:
+                return f"{basename}_{latest_index}"
+    return None
+
+def get_output_folders(audio_file_path) -> dict:
+    """
+    Creates and returns the transcriptions, chunks, filled_forms, telemetry and journals folders for an audio file:
+    under data/test for the ground truth recordings, under data/trials otherwise.
+    """
     if "data/test" in audio_file_path:
         root = "data/test"
     else:
         root = "data/trials"
-    transcriptions_folder = os.path.join(root, "transcriptions");os.makedirs(transcriptions_folder, exist_ok=True)
-    chunks_folder = os.path.join(root, "chunks");os.makedirs(chunks_folder, exist_ok=True)
-    filled_form_folder = os.path.join(root, "filled_forms");os.makedirs(chunks_folder, exist_ok=True)
-    saved_files_base_name = get_next_transcription_file_name(audio_file_path, transcriptions_folder)
+    folders = {"root": root}
+    for folder in ("transcriptions", "chunks", "filled_forms", "telemetry", "journals"):
+        folders[folder] = os.path.join(root, folder)
+        os.makedirs(folders[folder], exist_ok=True)
+    return folders
 
-    # Step 2: Clean the audio
-    # cleaned_audio_path = "cleaned_audio.wav"  # Temporary path to save cleaned audio
-    # reduce_noise(audio_file_path, cleaned_audio_path)
-    # print(f"Cleaned audio saved to: {cleaned_audio_path}")
-
-    model = load_model("large")
+def transcribe_note(audio_file_path, model_name: str = "large", transcription_client=None, model=None, cache=None, clean: bool = False) -> str:
+    """
+    Transcribes an audio file on the transcription server when it is running, otherwise with
+    the given model, loading one in this process if none is given. With clean, the audio is
+    denoised in memory first. Transcripts are cached by the hash of the audio bytes, the model
+    name, the backend that transcribes them (the server's when it is running), and whether the
+    audio was cleaned.
+    """
+    transcription_client = transcription_client or TranscriptionClient()
+    health = transcription_client.health()
+    backend = health.get("backend") if health else getattr(model, "name", None) or TRANSCRIPTION_BACKEND
+    if cache is not None:
+        cache_key = hash_parts(file_hash(audio_file_path), model_name, backend, *(["clean"] if clean else []))
+        cached = cache.get("transcriptions", cache_key)
+        if cached is not None:
+            print("Transcription loaded from the cache")
+            return cached["text"]
+    if health:
+        transcribed_text = transcription_client.transcribe(audio_file_path, model_name, clean)
+    else:
+        if model is None:
+            print("Transcription server not running (python -m src.audio_processing.transcription_server), loading the model in this process.")
+            model = load_model(model_name)
+        transcribed_text = transcribe_audio(clean_audio(audio_file_path) if clean else audio_file_path, model)
+    if cache is not None:
+        cache.put("transcriptions", cache_key, {"text": transcribed_text})
+    return transcribed_text
 
-    transcribed_text = transcribe_audio(audio_file_path, model)
-    print(f"Transcribed Text: {transcribed_text}")
-    transcription_file_path = os.path.join(transcriptions_folder, f"{saved_files_base_name}.txt")
-    save_transcription(transcribed_text, transcription_file_path)
-    print(f"Transcription saved to: {transcription_file_path}")
-    try:
-        transcriptions_comparison = compare(transcription_file_path, "transcriptions")
-        print(transcriptions_comparison)
-    except:
-        pass
+def find_previous_note_base_name(audio_file_path, folders: dict, saved_files_base_name: str):
+    """
+    The base name of the latest earlier output of this audio file with saved chunks and filled form,
+    e.g. before a re-recorded correction was saved over it, None when there is none.
+    """
+    basename = os.path.splitext(os.path.basename(audio_file_path))[0]
+    index = int(saved_files_base_name.split('_')[-1])
+    for previous_index in range(index - 1, 0, -1):
+        previous_base_name = f"{basename}_{previous_index}"
+        if load_previous_note(os.path.join(folders["chunks"], f"{previous_base_name}.json")) is not None:
+            return previous_base_name
+    return None
 
-    chunked_output = chunk_transcription(transcribed_text)
+def chunk_and_fill_note(transcribed_text, folders: dict, saved_files_base_name: str, form_dataframe, cache=None, response_cache=None, previous_base_name: str = None) -> dict:
+    """
+    Chunks a transcription, fills the form from the chunks and saves both, along with the
+    telemetry of the note's LLM calls. With previous_base_name, only the rows of the body systems
+    whose chunks changed since that earlier output are filled again and merged into its filled form.
+    Row answers are checkpointed to the note's journal as they complete, so re-running an interrupted
+    note only sends the rows that had not completed or had failed.
+    Returns:
+        dict: The chunked output, the filled rows, the telemetry summary and the paths they were saved to.
+    """
+    telemetry = Telemetry(saved_files_base_name)
+    chunked_output = chunk_transcription(transcribed_text, cache=cache, telemetry=telemetry)
     print(f"Chunked Output: {chunked_output}")
-    chunks_file_path = os.path.join(chunks_folder, f"{saved_files_base_name}.json")
+    chunks_file_path = os.path.join(folders["chunks"], f"{saved_files_base_name}.json")
     save_chunks(chunked_output, chunks_file_path)
     print(f"Chunks saved to: {chunks_file_path}")
-    try:
-        chunks_comparison = compare(chunks_file_path, "chunks")
-        print(chunks_comparison)
-    except:
-        pass
 
-    form_dataframe = process_json_file("./form.json")
-    filled_rows = fill_form_from_chunks(form_dataframe, chunked_output)
+    previous_note = load_previous_note(os.path.join(folders["chunks"], f"{previous_base_name}.json")) if previous_base_name else None
+    journal = FillJournal(os.path.join(folders["journals"], f"{saved_files_base_name}.jsonl"))
+    try:
+        if not chunked_output:
+            filled_rows = {}
+        elif previous_note is not None:
+            filled_rows, _ = refill_form(form_dataframe, *previous_note, chunked_output, response_cache=response_cache, telemetry=telemetry, rule_engine=get_rule_engine(), journal=journal)
+        else:
+            filled_rows = fill_form_from_chunks(form_dataframe, chunked_output, response_cache=response_cache, telemetry=telemetry, rule_engine=get_rule_engine(), journal=journal)
+        failed_rows = [entry["row_name"] for entry in journal.failed()]
+    finally:
+        journal.close()
     print(f"Filled rows: {filled_rows}")
-    filled_form_file_path = os.path.join(filled_form_folder, f"{saved_files_base_name}.json")
+    filled_form_file_path = os.path.join(folders["filled_forms"], f"{saved_files_base_name}.json")
     save_filled_form(filled_rows, filled_form_file_path)
-    print(f"Chunks saved to: {chunks_file_path}")
+    print(telemetry.format_summary())
+    telemetry.save(folders["telemetry"], saved_files_base_name)
+    return {
+        "telemetry": telemetry.summary()["total"],
+        "chunked_output": chunked_output,
+        "chunks_file_path": chunks_file_path,
+        "filled_rows": filled_rows,
+        "failed_rows": failed_rows,
+        "filled_form_file_path": filled_form_file_path,
+    }
+
+def print_comparison(file_path, type):
+    """
+    Prints the comparison of an output with its ground truth, or why it could not be compared.
+    """
     try:
-        filled_forms_comparison = compare(filled_form_file_path, "filled_forms")
-        print(filled_forms_comparison)
-    except:
-        pass
+        comparison = compare(file_path, type)
+    except (OSError, ValueError) as e:
+        print(f"Comparison of {file_path} with its ground truth failed: {e}")
+        return
+    if comparison is not None:
+        print(comparison)
+
+def main():
+    audio_file_path = input("Enter the path to the audio file: ").strip().strip("'")
+    if not os.path.exists(audio_file_path):
+        print(f"Error: The file '{audio_file_path}' does not exist.")
+        return
+    folders = get_output_folders(audio_file_path)
+    cache = get_stage_cache()
+
+    transcribed_text = transcribe_note(audio_file_path, "large", cache=cache, clean=True)
+    print(f"Transcribed Text: {transcribed_text}")
+    saved_files_base_name = find_matching_transcription_file_name(audio_file_path, folders["transcriptions"], transcribed_text) or get_next_transcription_file_name(audio_file_path, folders["transcriptions"])
+    transcription_file_path = os.path.join(folders["transcriptions"], f"{saved_files_base_name}.txt")
+    save_transcription(transcribed_text, transcription_file_path)
+    print(f"Transcription saved to: {transcription_file_path}")
+    print_comparison(transcription_file_path, "transcriptions")
+
+    form_dataframe = load_form_index("./form.json")
+    previous_base_name = find_previous_note_base_name(audio_file_path, folders, saved_files_base_name) if INCREMENTAL_REFILL else None
+    if previous_base_name:
+        print(f"Refilling only the body systems that changed since {previous_base_name}")
+    note = chunk_and_fill_note(transcribed_text, folders, saved_files_base_name, form_dataframe, cache, get_response_cache(), previous_base_name)
+    print_comparison(note["chunks_file_path"], "chunks")
+    print_comparison(note["filled_form_file_path"], "filled_forms")
     breakpoint()
 
 
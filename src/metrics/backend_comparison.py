@@ -0,0 +1,63 @@
+# backend_comparison.py
+import os
+import time
+import tempfile
+import argparse
+from src.audio_processing.audio_cache import get_audio_cache, WHISPER_SAMPLE_RATE
+from src.audio_processing.transcriber import load_model, transcribe_audio, save_transcription
+from src.audio_processing.backends import installed_backends
+from src.metrics.compare import compare_txt_files
+
+def compare_backends(audio_folder: str, transcriptions_folder: str, backends, model_name: str) -> list:
+    """
+    Transcribes every recording that has a ground truth transcription with each backend, and
+    reports its real-time factor (transcription seconds per audio second, lower is faster) and
+    its similarity to the ground truth.
+    """
+    audio_file_paths = sorted(
+        os.path.join(audio_folder, file) for file in os.listdir(audio_folder)
+        if os.path.exists(os.path.join(transcriptions_folder, f"{os.path.splitext(file)[0]}_0.txt"))
+    )
+    # Decode up front so every backend is timed on transcription alone.
+    samples = {audio_file_path: get_audio_cache().load(audio_file_path) for audio_file_path in audio_file_paths}
+    results = []
+    with tempfile.TemporaryDirectory() as output_folder:
+        for backend in backends:
+            t = time.time()
+            model = load_model(model_name, backend)
+            load_seconds = time.time() - t
+            transcription_seconds, audio_seconds, similarities = 0.0, 0.0, []
+            for audio_file_path in audio_file_paths:
+                base_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+                t = time.time()
+                text = transcribe_audio(samples[audio_file_path], model)
+                transcription_seconds += time.time() - t
+                audio_seconds += len(samples[audio_file_path]) / WHISPER_SAMPLE_RATE
+                pred_file_path = os.path.join(output_folder, f"{backend}_{base_name}.txt")
+                save_transcription(text, pred_file_path)
+                similarities.append(compare_txt_files(pred_file_path, os.path.join(transcriptions_folder, f"{base_name}_0.txt")))
+            results.append({
+                "backend": backend,
+                "model": model_name,
+                "load_seconds": load_seconds,
+                "real_time_factor": transcription_seconds / audio_seconds if audio_seconds else 0.0,
+                "mean_similarity": sum(similarities) / len(similarities) if similarities else 0.0,
+                "similarities": dict(zip((os.path.basename(path) for path in audio_file_paths), similarities)),
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare transcription backends on data/test.")
+    parser.add_argument("--backends", nargs="+", default=installed_backends(), help="Backends to compare, defaults to every installed one.")
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--audio", default="data/test/audio")
+    parser.add_argument("--transcriptions", default="data/test/transcriptions")
+    args = parser.parse_args()
+
+    results = compare_backends(args.audio, args.transcriptions, args.backends, args.model)
+    print(f"{'backend':<16} {'model':<8} {'load s':>7} {'RTF':>6} {'similarity':>10}")
+    for result in results:
+        print(f"{result['backend']:<16} {result['model']:<8} {result['load_seconds']:>7.1f} {result['real_time_factor']:>6.3f} {result['mean_similarity']:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# batched_accuracy.py
+import os
+import glob
+import argparse
+import tempfile
+
+from src.text_processing.chunker import chunk_transcription
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import fill_form_from_chunks, save_filled_form, select_candidate_rows, split_into_group_batches, DEFAULT_ROWS_PER_REQUEST
+from src.metrics.compare import compare_json_files
+
+def compare_fill_modes(root, rows_per_request):
+    """
+    Chunks every ground truth transcription under root, fills the form per row and per group,
+    and scores both against the ground truth filled forms.
+    """
+    form_dataframe = load_form_index("./form.json")
+    totals = {mode: {"requests": 0, "number_of_keys_missed": 0, "number_of_keys_overfilled": 0, "number_of_keys_filled_incorrectly": 0} for mode in ("row", "group")}
+    with tempfile.TemporaryDirectory() as output_folder:
+        for transcription_file_path in sorted(glob.glob(os.path.join(root, "transcriptions", "*.txt"))):
+            base_name = os.path.splitext(os.path.basename(transcription_file_path))[0]
+            gt_file_path = os.path.join(root, "filled_forms", f"{base_name}.json")
+            if not os.path.exists(gt_file_path):
+                continue
+            with open(transcription_file_path, 'r') as file:
+                chunked_output = chunk_transcription(file.read())
+            if not chunked_output:
+                continue
+            rows = select_candidate_rows(form_dataframe, chunked_output).to_dict('records')
+            requests = {"row": len(rows), "group": len(split_into_group_batches(rows, rows_per_request))}
+            for mode in ("row", "group"):
+                pred_file_path = os.path.join(output_folder, f"{base_name}_{mode}.json")
+                save_filled_form(fill_form_from_chunks(form_dataframe, chunked_output, mode=mode, rows_per_request=rows_per_request), pred_file_path)
+                result = compare_json_files(pred_file_path, gt_file_path)
+                print(f"{base_name:>18} {mode:>5} requests={requests[mode]:>4} missed={result['number_of_keys_missed']:>3} overfilled={result['number_of_keys_overfilled']:>3} incorrect={result['number_of_keys_filled_incorrectly']:>3}")
+                totals[mode]["requests"] += requests[mode]
+                for key in ("number_of_keys_missed", "number_of_keys_overfilled", "number_of_keys_filled_incorrectly"):
+                    totals[mode][key] += result[key]
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy of group mode against per-row mode on the ground truth set.")
+    parser.add_argument("--root", default="data/test")
+    parser.add_argument("--rows-per-request", type=int, default=DEFAULT_ROWS_PER_REQUEST)
+    args = parser.parse_args()
+    for mode, total in compare_fill_modes(args.root, args.rows_per_request).items():
+        print(f"{mode:>5} total: {total}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# benchmark.py
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tempfile
+
+from src.text_processing.chunker import chunk_transcription
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import fill_form_from_chunks, save_filled_form
+from src.form_filling.rules import get_rule_engine
+from src.metrics.compare import compare_json_files, compare_txt_files
+from utils.llm_client import make_async_client, pipeline_responder, LLM_RECORDINGS_PATH
+from utils.telemetry import Telemetry
+
+ACCURACY_KEYS = ("number_of_keys_missed", "number_of_keys_overfilled", "number_of_keys_filled_incorrectly")
+
+def list_notes(root: str) -> list:
+    """
+    The notes of the ground truth set: base names with both a transcription and a filled form.
+    """
+    return [
+        os.path.splitext(os.path.basename(path))[0]
+        for path in sorted(glob.glob(os.path.join(root, "transcriptions", "*.txt")))
+        if os.path.exists(os.path.join(root, "filled_forms", os.path.basename(path).replace(".txt", ".json")))
+    ]
+
+def find_audio_file(root: str, base_name: str):
+    matches = glob.glob(os.path.join(root, "audio", f"{base_name.rsplit('_', 1)[0]}.*"))
+    return matches[0] if matches else None
+
+def transcribe_and_score(audio_file_path, gt_file_path, model, output_folder) -> dict:
+    from src.audio_processing.audio_cache import get_audio_cache, WHISPER_SAMPLE_RATE
+    from src.audio_processing.transcriber import transcribe_audio, save_transcription
+
+    samples = get_audio_cache().load(audio_file_path)
+    t = time.perf_counter()
+    text = transcribe_audio(samples, model)
+    seconds = time.perf_counter() - t
+    pred_file_path = os.path.join(output_folder, os.path.basename(gt_file_path))
+    save_transcription(text, pred_file_path)
+    return {
+        "seconds": seconds,
+        "real_time_factor": seconds / (len(samples) / WHISPER_SAMPLE_RATE),
+        "similarity": compare_txt_files(pred_file_path, gt_file_path),
+    }
+
+def benchmark_note(root, base_name, form_dataframe, async_client, output_folder, mode, transcription_model=None) -> dict:
+    """
+    Runs one note of the ground truth set through the pipeline without caches and measures every stage.
+    """
+    result = {"note": base_name}
+    gt_transcription_path = os.path.join(root, "transcriptions", f"{base_name}.txt")
+    if transcription_model is not None:
+        audio_file_path = find_audio_file(root, base_name)
+        if audio_file_path:
+            result["transcription"] = transcribe_and_score(audio_file_path, gt_transcription_path, transcription_model, output_folder)
+    with open(gt_transcription_path, 'r') as file:
+        transcribed_text = file.read()
+
+    telemetry = Telemetry(base_name)
+    t = time.perf_counter()
+    chunked_output = chunk_transcription(transcribed_text, async_client=async_client, telemetry=telemetry)
+    chunking_seconds = time.perf_counter() - t
+    t = time.perf_counter()
+    filled_rows = fill_form_from_chunks(form_dataframe, chunked_output, async_client=async_client, mode=mode, telemetry=telemetry, rule_engine=get_rule_engine()) if chunked_output else {}
+    filling_seconds = time.perf_counter() - t
+
+    pred_file_path = os.path.join(output_folder, f"{base_name}.json")
+    save_filled_form(filled_rows, pred_file_path)
+    stages = telemetry.summary()["stages"]
+    result["chunking"] = dict(stages.get("chunking", Telemetry.aggregate([])), seconds=chunking_seconds)
+    result["form_filling"] = dict(stages.get("form_filling", Telemetry.aggregate([])), seconds=filling_seconds, filled_rows=len(filled_rows))
+    try:
+        result["accuracy"] = compare_json_files(pred_file_path, os.path.join(root, "filled_forms", f"{base_name}.json"))
+    except ValueError as e:
+        result["accuracy_error"] = f"unreadable ground truth: {e}"
+    return result
+
+def summarize(notes: list, total_seconds: float) -> dict:
+    summary = {"notes": len(notes), "seconds": total_seconds, "notes_per_minute": 60 * len(notes) / total_seconds if total_seconds else 0.0}
+    for stage in ("chunking", "form_filling"):
+        calls = sum(note[stage]["calls"] for note in notes)
+        seconds = sum(note[stage]["seconds"] for note in notes)
+        summary[stage] = {
+            "seconds": seconds,
+            "calls": calls,
+            "calls_per_second": calls / seconds if seconds else 0.0,
+            "prompt_tokens": sum(note[stage]["prompt_tokens"] for note in notes),
+            "completion_tokens": sum(note[stage]["completion_tokens"] for note in notes),
+            "cached_tokens": sum(note[stage]["cached_tokens"] for note in notes),
+            "errors": sum(note[stage]["errors"] for note in notes),
+            "latency_seconds_p95": max((note[stage]["latency_seconds_p95"] for note in notes), default=0.0),
+        }
+    scored = [note for note in notes if "accuracy" in note]
+    summary["accuracy"] = {key: sum(note["accuracy"][key] for note in scored) for key in ACCURACY_KEYS}
+    summary["accuracy"]["scored_notes"] = len(scored)
+    transcribed = [note["transcription"] for note in notes if "transcription" in note]
+    if transcribed:
+        summary["transcription"] = {
+            "seconds": sum(transcription["seconds"] for transcription in transcribed),
+            "real_time_factor": sum(transcription["real_time_factor"] for transcription in transcribed) / len(transcribed),
+            "mean_similarity": sum(transcription["similarity"] for transcription in transcribed) / len(transcribed),
+        }
+    return summary
+
+def find_regressions(summary: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Accuracy counts that went up, transcript similarity that went down, and stage times or token
+    counts more than tolerance above the baseline report's.
+    """
+    regressions = [f"{key}: {baseline['accuracy'][key]} -> {summary['accuracy'][key]}" for key in ACCURACY_KEYS if summary["accuracy"][key] > baseline["accuracy"][key]]
+    if "transcription" in summary and "transcription" in baseline and summary["transcription"]["mean_similarity"] < baseline["transcription"]["mean_similarity"] - 0.01:
+        regressions.append(f"transcript similarity: {baseline['transcription']['mean_similarity']:.3f} -> {summary['transcription']['mean_similarity']:.3f}")
+    for stage in ("chunking", "form_filling"):
+        for key in ("seconds", "calls", "prompt_tokens"):
+            if summary[stage][key] > (1 + tolerance) * baseline[stage][key] + 1e-9:
+                regressions.append(f"{stage} {key}: {baseline[stage][key]:.1f} -> {summary[stage][key]:.1f}")
+    return regressions
+
+def run_benchmark(root: str, async_client, mode: str = "row", transcription_model=None) -> dict:
+    form_dataframe = load_form_index("./form.json")
+    notes = []
+    t = time.perf_counter()
+    with tempfile.TemporaryDirectory() as output_folder:
+        for base_name in list_notes(root):
+            notes.append(benchmark_note(root, base_name, form_dataframe, async_client, output_folder, mode, transcription_model))
+    return {"summary": summarize(notes, time.perf_counter() - t), "notes": notes}
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the pipeline over the ground truth set.")
+    parser.add_argument("--root", default="data/test")
+    parser.add_argument("--recordings", default=LLM_RECORDINGS_PATH, help="Recorded LLM responses to replay.")
+    parser.add_argument("--record", action="store_true", help="Call the API and record its responses instead of replaying.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per replayed call.")
+    parser.add_argument("--mode", choices=("row", "group"), default="row")
+    parser.add_argument("--transcription-backend", help="Also transcribe data/test audio with this backend and score it.")
+    parser.add_argument("--transcription-model", default="base")
+    parser.add_argument("--output", help="Where to write the JSON report.")
+    parser.add_argument("--baseline", help="Earlier report to check for regressions; exits with status 1 if any.")
+    args = parser.parse_args()
+
+    # Requests missing from the recordings get stand-in answers, reported as replay_misses.
+    async_client = make_async_client("record" if args.record else "replay", args.recordings, args.latency, 0.0, 0.0, fallback_responder=pipeline_responder)
+    transcription_model = None
+    if args.transcription_backend:
+        from src.audio_processing.transcriber import load_model
+        transcription_model = load_model(args.transcription_model, args.transcription_backend)
+
+    report = run_benchmark(args.root, async_client, args.mode, transcription_model)
+    report["config"] = {"mode": args.mode, "record": args.record, "latency": args.latency, "transcription_backend": args.transcription_backend, "transcription_model": args.transcription_model}
+    if not args.record:
+        report["summary"]["replay_misses"] = async_client.number_of_misses
+    output_path = args.output or os.path.join(args.root, "benchmarks", f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(json.dumps(report["summary"], indent=4))
+    print(f"Report saved to {output_path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = find_regressions(report["summary"], json.load(file)["summary"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import os
 import re
 import glob
 import json
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
 
 def extract_name(file_basename):
     return '_'.join(tmp.split('_')[:-1])
@@ -0,0 +1,53 @@
+# fill_throughput.py
+import time
+import asyncio
+import argparse
+
+from src.text_processing.process_form import process_json_file
+from src.form_filling.form_filler import afill_form_from_chunks
+from utils.llm_client import StandInAsyncClient
+
+chunked_output = {
+    'neurological': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'patient is anxious but cooperative, intubated, tract strengths are 4s in uppers and 3s in lowers'}, 'EENT': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'bilateral hearing and vision impairments, tongue and oral mucosa is dry, teeth are decayed and missing'}, 'cardiovascular': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'click present'}, 'respiratory': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'diseased lungs, decreased lung sounds in the right base'}, 'gastrointestinal': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'abdomen is distended, patient with diarrhea and incontinence'}, 'genitourinary': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'foliocytosis'}, 'musculoskeletal': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': ''}, 'integumentary': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'skin over trunk, back and upper extremities is bruised, dry and flaking.'}, 'KUPIDS': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': ''}
+}
+
+def run_benchmark(form_dataframe, concurrency_levels, latency, rate_limit_probability):
+    """
+    Fills the form once per concurrency level against the stand-in client and reports throughput.
+    Every run is checked against the concurrency 1 run, which is equivalent to the sequential loop.
+    """
+    results = []
+    reference = None
+    for concurrency in concurrency_levels:
+        client = StandInAsyncClient(latency=latency, rate_limit_probability=rate_limit_probability)
+        t = time.time()
+        filled_rows = asyncio.run(afill_form_from_chunks(form_dataframe, chunked_output, async_client=client, concurrency=concurrency, max_retries=10))
+        elapsed = time.time() - t
+        reference = filled_rows if reference is None else reference
+        results.append({
+            "concurrency": concurrency,
+            "calls": client.number_of_calls,
+            "rate_limited": client.number_of_rate_limits,
+            "max_in_flight": client.max_in_flight,
+            "seconds": elapsed,
+            "calls_per_second": client.number_of_calls / elapsed,
+            "same_output": filled_rows == reference and list(filled_rows) == list(reference),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of async form filling against a stand-in client.")
+    parser.add_argument("--form", default="./form.json")
+    parser.add_argument("--latency", type=float, default=0.05, help="Injected seconds per call.")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    form_dataframe = process_json_file(args.form)
+    results = run_benchmark(form_dataframe, args.concurrency, args.latency, args.rate_limit_probability)
+    print(f"{'concurrency':>11} {'calls':>6} {'429s':>5} {'in flight':>9} {'seconds':>8} {'calls/s':>8} {'same output':>11}")
+    for result in results:
+        print(f"{result['concurrency']:>11} {result['calls']:>6} {result['rate_limited']:>5} {result['max_in_flight']:>9} {result['seconds']:>8.2f} {result['calls_per_second']:>8.1f} {str(result['same_output']):>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# prefix_reuse.py
+import json
+import asyncio
+import hashlib
+import argparse
+
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import afill_form_from_chunks
+from src.form_filling.response_models import ResponseModelRegistry
+from src.metrics.fill_throughput import chunked_output
+from utils.llm_client import StandInAsyncClient, make_completion, make_usage
+from utils.telemetry import Telemetry
+
+# Approximation used throughout the stand-ins: one token per four characters.
+CHARACTERS_PER_TOKEN = 4
+# The provider caches prompts of at least 1024 tokens, in increments of 128 tokens.
+MINIMUM_CACHED_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+# Price of a cached prompt token relative to an uncached one.
+CACHED_TOKEN_PRICE = 0.5
+
+class PrefixCachingStandInClient(StandInAsyncClient):
+    """
+    Stand-in client that simulates provider-side prompt caching: the longest prefix, in 128 token
+    blocks, shared with an earlier request is reported as cached_tokens, from 1024 tokens up.
+    The response schema comes before the messages, as it does in the provider's prompt.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        self.seen_prefixes = set()
+        self.number_of_cache_hits = 0
+
+    def respond(self, model, messages, response_format):
+        completion = super().respond(model, messages, response_format)
+        prompt = json.dumps(response_format, sort_keys=True) + "".join(f"{message['role']}:{message['content']}" for message in messages)
+        block = CACHE_BLOCK_TOKENS * CHARACTERS_PER_TOKEN
+        digest = hashlib.sha256(model.encode())
+        cached_blocks, matching = 0, True
+        for start in range(0, len(prompt) - block + 1, block):
+            digest.update(prompt[start:start + block].encode())
+            prefix = digest.hexdigest()
+            if matching and prefix in self.seen_prefixes:
+                cached_blocks += 1
+            else:
+                matching = False
+                self.seen_prefixes.add(prefix)
+        cached_tokens = cached_blocks * CACHE_BLOCK_TOKENS if cached_blocks * CACHE_BLOCK_TOKENS >= MINIMUM_CACHED_TOKENS else 0
+        self.number_of_cache_hits += cached_tokens > 0
+        usage = completion.usage
+        return make_completion(completion.choices[0].message.content, make_usage(len(prompt) // CHARACTERS_PER_TOKEN, usage.completion_tokens, cached_tokens))
+
+def measure_prefix_reuse(form_dataframe, modes, note=chunked_output, cached_token_price: float = CACHED_TOKEN_PRICE) -> list:
+    """
+    Fills the note once per prompt layout. Cached tokens only lower the bill, so layouts are compared
+    on billed_prompt_tokens, uncached tokens plus cached_token_price times cached tokens, relative to
+    row mode when it is measured.
+    """
+    results = []
+    for mode in modes:
+        client = PrefixCachingStandInClient()
+        telemetry = Telemetry(mode)
+        asyncio.run(afill_form_from_chunks(form_dataframe, note, async_client=client, concurrency=1, registry=ResponseModelRegistry(path=None), mode=mode, telemetry=telemetry))
+        total = telemetry.summary()["total"]
+        results.append({
+            "mode": mode,
+            "calls": total["calls"],
+            "calls_with_cached_prefix": client.number_of_cache_hits,
+            "prompt_tokens": total["prompt_tokens"],
+            "cached_tokens": total["cached_tokens"],
+            "cached_share": total["cached_tokens"] / total["prompt_tokens"] if total["prompt_tokens"] else 0.0,
+            "billed_prompt_tokens": total["prompt_tokens"] - (1 - cached_token_price) * total["cached_tokens"],
+        })
+    row_billed = next((result["billed_prompt_tokens"] for result in results if result["mode"] == "row"), None)
+    for result in results:
+        result["billed_relative_to_row"] = result["billed_prompt_tokens"] / row_billed if row_billed else None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt prefix reuse across the form filling calls of a note, per prompt layout.")
+    parser.add_argument("--form", default="./form.json")
+    parser.add_argument("--modes", nargs="+", default=["row", "group", "prefix"])
+    parser.add_argument("--cached-token-price", type=float, default=CACHED_TOKEN_PRICE, help="Price of a cached prompt token relative to an uncached one.")
+    args = parser.parse_args()
+
+    results = measure_prefix_reuse(load_form_index(args.form), args.modes, cached_token_price=args.cached_token_price)
+    print(f"{'mode':>6} {'calls':>6} {'hits':>6} {'prompt':>8} {'cached':>8} {'cached %':>8} {'billed':>8} {'vs row':>6}")
+    for result in results:
+        relative = f"{result['billed_relative_to_row']:.2f}" if result['billed_relative_to_row'] is not None else "-"
+        print(f"{result['mode']:>6} {result['calls']:>6} {result['calls_with_cached_prefix']:>6} {result['prompt_tokens']:>8} {result['cached_tokens']:>8} {100 * result['cached_share']:>8.1f} {result['billed_prompt_tokens']:>8.0f} {relative:>6}")
+
+if __name__ == "__main__":
+    main()
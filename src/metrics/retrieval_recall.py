@@ -0,0 +1,68 @@
+# retrieval_recall.py
+import os
+import re
+import glob
+import json
+import argparse
+
+from src.text_processing.chunker import chunk_transcription
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import select_candidate_rows
+from src.form_filling.retrieval import RetrievalIndex, DEFAULT_TOP_K_ROWS, DEFAULT_TOP_K_OPTIONS
+from utils.stage_cache import get_stage_cache
+
+def filled_keys(rows) -> dict:
+    return {re.sub(r'\[\d+\]', '', row_name).strip(): options for row_name, options in zip(rows['row_name'], rows['options'])}
+
+def measure_retrieval(root, top_k_rows, top_k_options):
+    """
+    Chunks every ground truth transcription under root (through the stage cache) and compares the
+    retrieved rows and options with all candidate rows: requests and options sent, and how many
+    ground truth answers are still reachable. Notes whose ground truth does not parse are reported
+    and left out of the totals.
+    """
+    form_dataframe = load_form_index("./form.json")
+    retrieval_index = RetrievalIndex(form_dataframe, top_k_rows, top_k_options)
+    totals = {"candidate_rows": 0, "retrieved_rows": 0, "candidate_options": 0, "retrieved_options": 0, "reachable_answers": 0, "retrieved_answers": 0}
+    for transcription_file_path in sorted(glob.glob(os.path.join(root, "transcriptions", "*.txt"))):
+        base_name = os.path.splitext(os.path.basename(transcription_file_path))[0]
+        gt_file_path = os.path.join(root, "filled_forms", f"{base_name}.json")
+        if not os.path.exists(gt_file_path):
+            continue
+        try:
+            with open(gt_file_path, 'r') as file:
+                ground_truth = json.load(file)
+        except ValueError as e:
+            print(f"{base_name:>18} skipped, unreadable ground truth: {e}")
+            continue
+        with open(transcription_file_path, 'r') as file:
+            chunked_output = chunk_transcription(file.read(), cache=get_stage_cache())
+        candidate_rows = select_candidate_rows(form_dataframe, chunked_output)
+        retrieved_rows = retrieval_index.shortlist(candidate_rows, chunked_output)
+        candidates, retrieved = filled_keys(candidate_rows), filled_keys(retrieved_rows)
+        result = {
+            "candidate_rows": len(candidate_rows),
+            "retrieved_rows": len(retrieved_rows),
+            "candidate_options": int(candidate_rows['options'].apply(len).sum()),
+            "retrieved_options": int(retrieved_rows['options'].apply(len).sum()),
+            "reachable_answers": sum(1 for key, value in ground_truth.items() if value in candidates.get(key, ())),
+            "retrieved_answers": sum(1 for key, value in ground_truth.items() if value in retrieved.get(key, ())),
+        }
+        print(f"{base_name:>18} " + " ".join(f"{key}={value}" for key, value in result.items()))
+        for key in totals:
+            totals[key] += result[key]
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests saved and answers lost by the retrieval shortlist on the ground truth set.")
+    parser.add_argument("--root", default="data/test")
+    parser.add_argument("--top-k-rows", type=int, default=DEFAULT_TOP_K_ROWS)
+    parser.add_argument("--top-k-options", type=int, default=DEFAULT_TOP_K_OPTIONS)
+    args = parser.parse_args()
+    totals = measure_retrieval(args.root, args.top_k_rows, args.top_k_options)
+    print(f"total: {totals}")
+    if totals["reachable_answers"]:
+        print(f"answer recall {totals['retrieved_answers'] / totals['reachable_answers']:.2%}, requests {totals['retrieved_rows']} instead of {totals['candidate_rows']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# rule_coverage.py
+import os
+import re
+import glob
+import json
+import argparse
+
+from src.text_processing.chunker import chunk_transcription
+from src.text_processing.process_form import load_form_index
+from src.form_filling.form_filler import select_candidate_rows
+from src.form_filling.rules import get_rule_engine
+from utils.stage_cache import get_stage_cache
+from utils.llm_client import StandInAsyncClient, pipeline_responder
+
+def measure_rule_coverage(root, async_client=None):
+    """
+    Chunks every ground truth transcription under root, applies the fill rules and reports the LLM
+    calls they save in row mode and how their answers compare with the ground truth filled forms.
+    Chunks go through the stage cache unless an async_client is injected. Notes whose ground truth
+    does not parse still count towards the calls, but not towards the accuracy.
+    """
+    form_dataframe = load_form_index("./form.json")
+    rule_engine = get_rule_engine()
+    problems = rule_engine.validate(form_dataframe)
+    if problems:
+        raise ValueError(f"Invalid fill rules: {problems}")
+    cache = get_stage_cache() if async_client is None else None
+    totals = {"calls_without_rules": 0, "calls_with_rules": 0, "correct": 0, "incorrect": 0, "overfilled": 0, "missed": 0, "unreadable_ground_truth": []}
+    for transcription_file_path in sorted(glob.glob(os.path.join(root, "transcriptions", "*.txt"))):
+        base_name = os.path.splitext(os.path.basename(transcription_file_path))[0]
+        gt_file_path = os.path.join(root, "filled_forms", f"{base_name}.json")
+        if not os.path.exists(gt_file_path):
+            continue
+        try:
+            with open(gt_file_path, 'r') as file:
+                ground_truth = json.load(file)
+        except ValueError as e:
+            print(f"{base_name:>18} unreadable ground truth, accuracy not scored: {e}")
+            totals["unreadable_ground_truth"].append(base_name)
+            ground_truth = None
+        with open(transcription_file_path, 'r') as file:
+            chunked_output = chunk_transcription(file.read(), async_client=async_client, cache=cache)
+        rows = select_candidate_rows(form_dataframe, chunked_output).to_dict('records')
+        result = {"calls_without_rules": len(rows), "calls_with_rules": len(rows), "correct": 0, "incorrect": 0, "overfilled": 0, "missed": 0}
+        for row in rows:
+            ruled = rule_engine.answer(row, chunked_output)
+            if ruled is None:
+                continue
+            result["calls_with_rules"] -= 1
+            key = re.sub(r'\[\d+\]', '', row["row_name"]).strip()
+            answer = ruled[1]
+            if ground_truth is None:
+                continue
+            if key not in ground_truth:
+                result["overfilled" if answer else "correct"] += 1
+            elif answer is None:
+                result["missed"] += 1
+            else:
+                result["correct" if ground_truth[key] == answer else "incorrect"] += 1
+        print(f"{base_name:>18} " + " ".join(f"{key}={value}" for key, value in result.items()))
+        for key in result:
+            totals[key] += result[key]
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM calls saved by the fill rules and their accuracy on the ground truth set.")
+    parser.add_argument("--root", default="data/test")
+    parser.add_argument("--stand-in", action="store_true", help="Chunk with the offline stand-in client, which refers every body system without exceptions, instead of LLM_CLIENT_MODE's client.")
+    args = parser.parse_args()
+    totals = measure_rule_coverage(args.root, StandInAsyncClient(latency=0, responder=pipeline_responder) if args.stand_in else None)
+    print(f"total: {totals}")
+    if totals["calls_without_rules"]:
+        print(f"call reduction {1 - totals['calls_with_rules'] / totals['calls_without_rules']:.2%}")
+
+if __name__ == "__main__":
+    main()
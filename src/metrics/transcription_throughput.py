@@ -0,0 +1,47 @@
+# transcription_throughput.py
+import os
+import time
+import argparse
+from src.audio_processing.audio_cache import get_audio_cache, WHISPER_SAMPLE_RATE
+from src.audio_processing.parallel_transcriber import ParallelTranscriber
+
+def run_benchmark(file_paths, model_name, worker_counts, threads_per_worker, segment_seconds):
+    """
+    Transcribes the same files once per worker count and reports throughput against the number of
+    cores in use. Audio is decoded into the cache beforehand so only transcription is timed.
+    """
+    audio_seconds = sum(len(get_audio_cache().load(file_path)) for file_path in file_paths) / WHISPER_SAMPLE_RATE
+    results = []
+    for workers in worker_counts:
+        with ParallelTranscriber(model_name, workers, threads_per_worker, segment_seconds) as transcriber:
+            # Warm up so model loading in each worker is not counted.
+            transcriber.transcribe_files(file_paths[:1] * workers)
+            t = time.time()
+            transcriber.transcribe_files(file_paths)
+            elapsed = time.time() - t
+        results.append({
+            "workers": workers,
+            "cores": workers * threads_per_worker,
+            "seconds": elapsed,
+            "files_per_hour": len(file_paths) * 3600 / elapsed,
+            "audio_seconds_per_second": audio_seconds / elapsed,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Files/hour of parallel transcription against core count.")
+    parser.add_argument("source", nargs="?", default="data/test/audio", help="Directory of audio files.")
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads-per-worker", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--segment-seconds", type=float, default=None, help="Split recordings longer than this across workers.")
+    args = parser.parse_args()
+
+    file_paths = sorted(os.path.join(args.source, file) for file in os.listdir(args.source) if file.lower().endswith(('.mp3', '.wav', '.m4a', '.flac', '.ogg')))
+    results = run_benchmark(file_paths, args.model, args.workers, args.threads_per_worker, args.segment_seconds)
+    print(f"{'workers':>7} {'cores':>5} {'seconds':>8} {'files/hour':>10} {'x realtime':>10}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['cores']:>5} {result['seconds']:>8.1f} {result['files_per_hour']:>10.1f} {result['audio_seconds_per_second']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
-from openai import OpenAI
 from enum import Enum
 from typing import Dict, Tuple
 from pydantic import BaseModel
-import os
+from src.form_filling.response_models import strict_response_format
 import json
+import asyncio
 
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+from utils.llm_client import get_async_client, acreate_completion
+from utils.stage_cache import hash_parts
+
+CHUNK_MODEL = "gpt-4o-2024-08-06"
 
 class BodySystem():
     body_system_list = [
@@ -26,6 +28,7 @@ class Chunk(BaseModel):
     exceptions_to_within_defined_limits: str
 
 Chunk.model_rebuild()
+chunk_response_format = strict_response_format(Chunk)
 
 chunker_schema_path = 'utils/chunker_schema.json'
 with open(chunker_schema_path, 'r') as file:
@@ -35,6 +38,8 @@ system_prompt = "You are an medical expert for the placeholder system. You will
 
 user_base_prompt = "Extract information about placeholder system from this summary"
 
+all_systems_system_prompt = f"You are an medical expert for the following body systems: {', '.join(BodySystem.body_system_list)}. You will be given an unstructured medical summary and you should extract information about each of these systems."
+
 assistant_base_prompt = """
     1. "is_referred_to_in_summary": If the summary refers to the placeholder system or any subject matter related to it, explicitly or implicitly, set this to True. If not, set to False. Look for short-forms like CV for cardiovascular, GI for gastrointestinal, GU for gastro urinary.
 
@@ -94,39 +99,107 @@ assistant_base_prompt = """
     }"""
 
 
-def chunk_transcription(transcription_text):
+async def achunk_body_system(transcription_text, body_system, async_client, max_retries: int = 3, telemetry=None):
+    """
+    Extracts the chunk of one body system. Rate limit and transient errors are retried with backoff.
+    """
+    completion = await acreate_completion(
+        async_client,
+        CHUNK_MODEL,
+        [
+            {"role": "system", "content": system_prompt.replace("placeholder", body_system)},
+            {"role": "user", "content": f"{user_base_prompt} {transcription_text}".replace("placeholder", body_system)},
+            {"role": "assistant", "content": assistant_base_prompt.replace("placeholder", body_system)}
+        ],
+        chunk_response_format,
+        max_retries,
+        telemetry,
+        "chunking",
+        body_system
+    )
+    return json.loads(completion.choices[0].message.content)
+
+async def achunk_all_body_systems(transcription_text, async_client, max_retries: int = 3, telemetry=None):
+    """
+    Extracts the chunks of all body systems with a single request, using utils/chunker_schema.json.
+    """
+    completion = await acreate_completion(
+        async_client,
+        CHUNK_MODEL,
+        [
+            {"role": "system", "content": all_systems_system_prompt},
+            {"role": "user", "content": f"{user_base_prompt} {transcription_text}".replace("placeholder", "every body")},
+            {"role": "assistant", "content": assistant_base_prompt.replace("placeholder", "given body")}
+        ],
+        chunker_schema,
+        max_retries,
+        telemetry,
+        "chunking",
+        "all systems"
+    )
+    return json.loads(completion.choices[0].message.content)
+
+def chunk_cache_key(transcription_text, single_call: bool) -> str:
+    prompts = (system_prompt, user_base_prompt, assistant_base_prompt) + ((all_systems_system_prompt, chunker_schema) if single_call else ())
+    return hash_parts(transcription_text, CHUNK_MODEL, prompts, BodySystem.body_system_list)
+
+async def achunk_transcription(transcription_text, async_client=None, single_call: bool = False, max_retries: int = 3, cache=None, telemetry=None):
+    """
+    Async counterpart of chunk_transcription. The body systems are extracted concurrently and a
+    system that still fails after its retries is left out, keeping the results of the others.
+    Only complete outputs are stored in the cache.
+    """
+    if cache is not None:
+        cache_key = chunk_cache_key(transcription_text, single_call)
+        cached = cache.get("chunks", cache_key)
+        if cached is not None:
+            print("Chunks loaded from the cache")
+            if telemetry is not None:
+                telemetry.record("chunking", model=CHUNK_MODEL, cache_hit=True)
+            return cached
+    response = await achunk_uncached(transcription_text, async_client, single_call, max_retries, telemetry)
+    if cache is not None and response and all(body_system in response for body_system in BodySystem.body_system_list):
+        cache.put("chunks", cache_key, response)
+    return response
+
+async def achunk_uncached(transcription_text, async_client=None, single_call: bool = False, max_retries: int = 3, telemetry=None):
+    async_client = async_client or get_async_client()
+
+    print("Chunking the transcription into modules...")
+    if single_call:
+        try:
+            return await achunk_all_body_systems(transcription_text, async_client, max_retries, telemetry)
+        except Exception as e:
+            print(f"An error occurred while processing the transcription in a single call, falling back to one call per system: {e}")
+
+    results = await asyncio.gather(
+        *(achunk_body_system(transcription_text, body_system, async_client, max_retries, telemetry) for body_system in BodySystem.body_system_list),
+        return_exceptions=True
+    )
+    response = {}
+    for body_system, result in zip(BodySystem.body_system_list, results):
+        if isinstance(result, Exception):
+            print(f"An error occurred while processing the {body_system} system: {result}")
+        else:
+            response[body_system] = result
+    return response or None
+
+def chunk_transcription(transcription_text, single_call: bool = False, async_client=None, cache=None, telemetry=None):
     """
     Chunk the transcription text into modules using GPT-4 API.
     
     Args:
     - transcription_text (str): The transcription text of a nurse summary.
-    - api_key (str): The API key to authenticate with OpenAI.
+    - single_call (bool): Extract all body systems with one request instead of one request per system.
+    - async_client (AsyncOpenAI): Client to use, defaults to the one selected by LLM_CLIENT_MODE.
+    - cache (StageCache): Cache of chunker outputs keyed by transcript, model and prompts.
+    - telemetry (Telemetry): Records usage, latency and retries of every call.
 
     Returns:
-    - list: A list of JSON objects with "system," "WDL," and "exceptions" fields.
+    - dict: Body system to its "is_referred_to_in_summary" and "exceptions_to_within_defined_limits"
+      fields, without the systems that failed. None if every system failed.
     """
-    if not api_key:
-        raise ValueError("OpenAI API key not found in environment variables. Please set 'OPENAI_API_KEY'.")
-    
-    response = {}
-    try:
-        print("Chunking the transcription into modules...")
-        for body_system in BodySystem.body_system_list:
-            system_specific_information = client.beta.chat.completions.parse(
-                model="gpt-4o-2024-08-06",
-                messages=[
-                    {"role": "system", "content": system_prompt.replace("placeholder", body_system)},
-                    {"role": "user", "content": f"{user_base_prompt} {transcription_text}".replace("placeholder", body_system)},
-                    {"role": "assistant", "content": assistant_base_prompt.replace("placeholder", body_system)}
-                ],
-                response_format=Chunk
-            )
-            response[body_system]=(system_specific_information.choices[0].message.parsed).__dict__
-        return response
-
-    except Exception as e:
-        print(f"An error occurred while processing the transcription: {e}")
-        return None
+    return asyncio.run(achunk_transcription(transcription_text, async_client=async_client, single_call=single_call, cache=cache, telemetry=telemetry))
     
 def save_chunks(chunked_output:Dict, json_file_path: str):
     """
@@ -1,5 +1,16 @@
 import pandas as pd
+import hashlib
+import pickle
+import mmap
 import json
+import os
+import re
+
+FORM_INDEX_PATH = "./data/form_index.pkl"
+# Bumped when the columns of the compiled index change, so older index files are rebuilt.
+FORM_INDEX_FORMAT = 2
+# Comma separated ids or names of the templates notes are filled against, e.g. "ICU". Empty selects every template.
+FORM_TEMPLATES = [template.strip() for template in os.getenv("FORM_TEMPLATES", "").split(",") if template.strip()]
 
 categories = {
     'neurological': [
@@ -25,14 +36,32 @@ categories = {
     'KUPIDS': ['KUPIDS Assessment', 'Part I, KUPIDS Diagnosis and History', 'Part II, KUPIDS Patient Evaluation', 'Part III, KUPIDS Swallow Screening']
 }
 
-def flatten_json(json_data):
+group_categories = {}
+for category, group_names in categories.items():
+    for group_name in group_names:
+        group_categories.setdefault(group_name, []).append(category)
+
+def filled_row_name(row_name: str) -> str:
+    """
+    The key a row is saved under in the filled form: its name without the '[id]' suffix.
+    """
+    return re.sub(r'\[\d+\]', '', row_name).strip()
+
+def is_selected_template(template_id, template_name, templates) -> bool:
+    return not templates or str(template_id) in templates or str(template_name).strip().lower() in {str(template).lower() for template in templates}
+
+def flatten_json(json_data, templates=None):
     """
     Flattens the JSON structure to extract relevant information and returns a DataFrame.
+    Args:
+        templates (list): Ids or names of the templates to keep, all templates when empty.
     """
     rows = []
 
     # Iterate over templates
     for template in json_data.get('templates', []):
+        if not is_selected_template(template.get('id'), template.get('name'), templates):
+            continue
         template_id = template.get('id')
         template_name = template.get('name')
         template_version_id = template.get('version_id')
@@ -82,14 +111,9 @@ def determine_categories(group_name):
     """
     Determines the category of the given group name.
     """
-    group_name = group_name.strip()
-    relevant_categories = []
-    for category, group_names in categories.items():
-        if group_name in group_names:
-            relevant_categories.append(category)
-    return relevant_categories
+    return list(group_categories.get(group_name.strip(), []))
 
-def process_json_file(json_path):
+def process_json_file(json_path, templates=None):
     """
     Reads a JSON file, flattens it, categorizes the data, and returns a processed DataFrame.
     """
@@ -97,9 +121,66 @@ def process_json_file(json_path):
         json_data = json.load(file)
 
     # Flatten the JSON data
-    df = flatten_json(json_data)
+    df = flatten_json(json_data, templates)
     
     # Determine categories for each group name
     df['assessment_names'] = df['group_name'].apply(determine_categories)
+    df['filled_name'] = df['row_name'].apply(filled_row_name)
+    return df
+
+def select_templates(df, templates):
+    """
+    Keeps the rows of the given template ids or names, with the index attrs, so the body system
+    index of a form compiled over every template still applies.
+    """
+    if not templates:
+        return df
+    is_selected = [is_selected_template(template_id, template_name, templates) for template_id, template_name in zip(df['template_id'], df['template_name'])]
+    if not any(is_selected):
+        raise ValueError(f"No template matches {templates}, the form has {sorted(set(df['template_name']))}")
+    return df[is_selected]
+
+
+def form_version(json_path):
+    """
+    Hash of the raw form JSON, used to tell whether a compiled index is stale.
+    """
+    with open(json_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def build_form_index(json_path, index_path=FORM_INDEX_PATH):
+    """
+    Compiles the form JSON into an on-disk index holding the flattened rows with their options,
+    a body system -> row label inverted index and the version hash of the source JSON.
+    """
+    df = process_json_file(json_path)
+    body_system_rows = {category: [] for category in categories}
+    for label, assessment_names in df['assessment_names'].items():
+        for assessment_name in assessment_names:
+            body_system_rows[assessment_name].append(label)
+    df.attrs['form_version'] = form_version(json_path)
+    df.attrs['form_index_format'] = FORM_INDEX_FORMAT
+    df.attrs['body_system_rows'] = body_system_rows
+    os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(df, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    print(f"Form index saved to {index_path}")
     return df
 
+def load_form_index(json_path, index_path=FORM_INDEX_PATH, templates=FORM_TEMPLATES):
+    """
+    Loads the compiled form index, memory-mapping the file, and rebuilds it when the form JSON
+    has changed since it was compiled. Returns the same DataFrame as process_json_file, with
+    'form_version' and 'body_system_rows' in its attrs, restricted to the selected templates.
+    """
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            df = pickle.loads(mapped)
+        if df.attrs.get('form_version') == form_version(json_path) and df.attrs.get('form_index_format') == FORM_INDEX_FORMAT:
+            return select_templates(df, templates)
+    return select_templates(build_form_index(json_path, index_path), templates)
+
+if __name__ == "__main__":
+    build_form_index("./form.json")
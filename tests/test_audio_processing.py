@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import soundfile as sf
+from src.audio_processing import audio_cache
+from src.audio_processing.audio_cache import AudioCache
+from src.audio_processing.audio_cleaning import reduce_noise_array
+from src.audio_processing.streaming import SAMPLE_RATE, pcm_frames, vad_segments, stream_transcribe, iter_sentences
+
+def tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return amplitude * np.sin(2 * np.pi * 220 * t)
+
+def silence(seconds):
+    return np.random.default_rng(0).normal(0, 1e-4, int(seconds * SAMPLE_RATE))
+
+def to_pcm_chunks(samples, chunk_bytes=1234):
+    pcm = (samples * 32767).astype(np.int16).tobytes()
+    return [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)]
+
+class FakeStreamingModel():
+    def __init__(self):
+        self.windows = []
+
+    def transcribe(self, samples, **kwargs):
+        self.windows.append(len(samples) / SAMPLE_RATE)
+        return {"text": f"Segment {len(self.windows)} done."}
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.recording = np.concatenate([silence(0.5), tone(1.0), silence(1.0), tone(2.0), silence(1.0)])
+
+    def test_vad_splits_on_silence(self):
+        segments = list(vad_segments(pcm_frames(to_pcm_chunks(self.recording))))
+        self.assertEqual(len(segments), 2)
+        self.assertAlmostEqual(segments[0][0], 0.3, delta=0.1)
+        self.assertAlmostEqual(segments[1][0], 2.3, delta=0.1)
+
+    def test_vad_bounds_segment_length(self):
+        segments = list(vad_segments(pcm_frames(to_pcm_chunks(tone(5.0))), max_segment_seconds=2.0))
+        self.assertEqual(len(segments), 3)
+        self.assertTrue(all(len(samples) <= 2.0 * SAMPLE_RATE for _, samples in segments))
+
+    def test_stream_transcribe_yields_segments_in_order(self):
+        model = FakeStreamingModel()
+        segments = list(stream_transcribe(to_pcm_chunks(self.recording), model))
+        self.assertEqual([segment["text"] for segment in segments], ["Segment 1 done.", "Segment 2 done."])
+        self.assertLess(segments[0]["end"], segments[1]["start"])
+
+    def test_iter_sentences(self):
+        segments = [{"text": "Heart rate is"}, {"text": "regular. Lungs clear. Skin"}, {"text": "warm"}]
+        self.assertEqual(list(iter_sentences(segments)), ["Heart rate is regular.", "Lungs clear.", "Skin warm"])
+
+class TestAudioCache(unittest.TestCase):
+
+    def test_decodes_once_then_memory_maps(self):
+        with tempfile.TemporaryDirectory() as directory:
+            audio_path = os.path.join(directory, "note.wav")
+            sf.write(audio_path, tone(1.0), SAMPLE_RATE)
+            cache = AudioCache(os.path.join(directory, "cache"))
+            decoded = audio_cache.decode
+            calls = []
+            audio_cache.decode = lambda *args: calls.append(args) or decoded(*args)
+            try:
+                first = cache.load(audio_path)
+                second = cache.load(audio_path)
+            finally:
+                audio_cache.decode = decoded
+            self.assertEqual(len(calls), 1)
+            self.assertIsInstance(second, np.memmap)
+            self.assertEqual(second.dtype, np.float32)
+            self.assertEqual(len(second), SAMPLE_RATE)
+            np.testing.assert_array_equal(first, second)
+
+class TestNoiseReduction(unittest.TestCase):
+
+    def test_blocks_are_stitched_to_input_length(self):
+        rng = np.random.default_rng(1)
+        samples = (np.concatenate([np.zeros(SAMPLE_RATE), tone(3.0), np.zeros(SAMPLE_RATE)]) + rng.normal(0, 0.02, 5 * SAMPLE_RATE)).astype(np.float32)
+        cleaned = reduce_noise_array(samples, block_seconds=2.0, overlap_seconds=0.5)
+        self.assertEqual(cleaned.dtype, np.float32)
+        self.assertEqual(len(cleaned), len(samples))
+        self.assertTrue(np.all(np.isfinite(cleaned)))
+        noise = slice(0, SAMPLE_RATE // 2)
+        self.assertLess(np.std(cleaned[noise]), np.std(samples[noise]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.text_processing.process_form import process_json_file, build_form_index
+from src.form_filling.form_filler import afill_form_from_chunks, select_candidate_rows, build_row_request, parse_row_answer, assemble_filled_rows
+from src.form_filling.response_models import ResponseModelRegistry
+from utils.llm_client import StandInAsyncClient, ResponseStore, RecordingAsyncClient, StubBatchClient, make_async_client, make_completion, make_usage, first_option_responder
+from src.form_filling.response_cache import ResponseCache
+from src.form_filling.retrieval import RetrievalIndex
+from src.form_filling.rules import RuleEngine
+from utils.telemetry import Telemetry
+from src.metrics.prefix_reuse import PrefixCachingStandInClient, measure_prefix_reuse
+from src.form_filling.batch_api import submit_backfill, finish_backfill
+from src.form_filling.incremental import changed_systems, refill_form
+from src.form_filling.journal import FillJournal
+
+chunked_output = {
+    'neurological': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'EENT': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'impaired vision bilaterally'},
+    'cardiovascular': {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': None},
+    'respiratory': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'gastrointestinal': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'genitourinary': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'musculoskeletal': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'integumentary': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+    'KUPIDS': {'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None},
+}
+
+class TestFormFiller(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Flatten the form once for all tests."""
+        cls.form_dataframe = process_json_file("./form.json")
+
+    def fill(self, client, concurrency, **kwargs):
+        return asyncio.run(afill_form_from_chunks(self.form_dataframe, chunked_output, async_client=client, concurrency=concurrency, max_retries=10, registry=ResponseModelRegistry(path=None), **kwargs))
+
+    def test_concurrency_does_not_change_output(self):
+        """Concurrent filling assembles the same ordered dict as a single slot."""
+        sequential = self.fill(StandInAsyncClient(latency=0), concurrency=1)
+        concurrent_client = StandInAsyncClient(latency=0.001)
+        concurrent = self.fill(concurrent_client, concurrency=8)
+        self.assertTrue(sequential)
+        self.assertEqual(list(sequential.items()), list(concurrent.items()))
+        self.assertLessEqual(concurrent_client.max_in_flight, 8)
+        self.assertEqual(sequential["Cardiac WDL"], "WDL")
+
+    def test_rate_limits_are_retried(self):
+        """Rows hit by a 429 are retried instead of being dropped."""
+        reference = self.fill(StandInAsyncClient(latency=0), concurrency=4)
+        client = StandInAsyncClient(latency=0, rate_limit_probability=0.3)
+        self.assertEqual(self.fill(client, concurrency=4), reference)
+        self.assertGreater(client.number_of_rate_limits, 0)
+
+    def test_only_referred_systems_are_scheduled(self):
+        """Rows of body systems that were not referred to never reach the client."""
+        candidate_rows = select_candidate_rows(self.form_dataframe, chunked_output)
+        self.assertTrue(all({'EENT', 'cardiovascular'} & set(names) for names in candidate_rows['assessment_names']))
+        self.assertEqual(len(candidate_rows), sum(group in ('EENT', 'Cardiac', 'Temporary Pacemaker', 'Permanent Pacemaker', 'Mucositis Assessment', 'Stroke Dysphagia Screen Part I', 'Stroke Dysphagia Screen Part II', 'Stroke Dysphagia Screen Part III', 'Pupillometer Checks') for group in self.form_dataframe['group_name'].str.strip()))
+        client = StandInAsyncClient(latency=0)
+        self.fill(client, concurrency=4)
+        self.assertEqual(client.number_of_calls, len(candidate_rows))
+
+    def test_index_candidate_rows_match_scan(self):
+        """The inverted index of the compiled form selects the same rows as scanning assessment_names."""
+        with tempfile.TemporaryDirectory() as directory:
+            indexed_form = build_form_index("./form.json", os.path.join(directory, "form_index.pkl"))
+        self.assertTrue(select_candidate_rows(indexed_form, chunked_output).equals(select_candidate_rows(self.form_dataframe, chunked_output)))
+
+    def test_response_format_registry(self):
+        """Response formats are generated once per row and options, and persisted across registries."""
+        row = self.form_dataframe.iloc[0].to_dict()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "response_schemas.json")
+            registry = ResponseModelRegistry(path)
+            response_format = registry.get_response_format(row)
+            self.assertIs(registry.get_response_format(row), response_format)
+            self.assertTrue(response_format["json_schema"]["strict"])
+            self.assertEqual(response_format["json_schema"]["schema"]["$defs"]["Options"]["enum"], ["WDL", "Exceptions to WDL", "Line item cannot be filled with the provided information"])
+            registry.save()
+            self.assertEqual(ResponseModelRegistry(path).response_formats, registry.response_formats)
+            changed_row = dict(row, options=["WDL"])
+            self.assertNotEqual(registry.key(changed_row), registry.key(row))
+
+    def test_response_formats_are_strict(self):
+        """Schemas built from model_json_schema close every object and require every property."""
+        registry = ResponseModelRegistry(path=None)
+        for response_format in (registry.get_response_format(self.form_dataframe.iloc[0].to_dict()), registry.get_open_response_format()):
+            schema = response_format["json_schema"]["schema"]
+            self.assertEqual(response_format["json_schema"]["name"], "Response")
+            self.assertFalse(schema["additionalProperties"])
+            self.assertEqual(schema["required"], list(schema["properties"]))
+        entry = schema["properties"]["line_item_entry_if_sufficient_information"]
+        self.assertEqual(entry["anyOf"], [{"type": "string"}, {"type": "null"}])
+        self.assertNotIn("default", entry)
+
+    def test_batch_workers_share_the_registry(self):
+        """Notes filled on run_batch's thread pool share one registry, and saving it while other notes add schemas loses nothing."""
+        notes = [dict(chunked_output, **{system: {'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': None}}) for system in ('neurological', 'respiratory', 'gastrointestinal', 'genitourinary', 'musculoskeletal', 'integumentary', 'KUPIDS', 'EENT')]
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ResponseModelRegistry(os.path.join(directory, "response_schemas.json"))
+            def fill_note(note):
+                return asyncio.run(afill_form_from_chunks(self.form_dataframe, note, async_client=StandInAsyncClient(latency=0), concurrency=4, registry=registry))
+            with ThreadPoolExecutor(max_workers=len(notes)) as executor:
+                filled_forms = list(executor.map(fill_note, notes))
+            self.assertTrue(all(filled_forms))
+            self.assertEqual(ResponseModelRegistry(registry.path).response_formats, registry.response_formats)
+            self.assertEqual([file for file in os.listdir(directory) if file.endswith(".tmp")], [])
+
+    def test_group_mode_maps_answers_to_rows(self):
+        """Multi-row requests fill the same keys as per-row requests with far fewer calls."""
+        row_client, group_client = StandInAsyncClient(latency=0), StandInAsyncClient(latency=0)
+        per_row = self.fill(row_client, concurrency=4)
+        per_group = self.fill(group_client, concurrency=4, mode="group", rows_per_request=20)
+        self.assertEqual(per_group, per_row)
+        self.assertLess(group_client.number_of_calls * 5, row_client.number_of_calls)
+
+    def test_row_answers_are_cached(self):
+        """A re-run only sends the rows whose canonicalised chunk information changed."""
+        response_cache = ResponseCache(":memory:")
+        first_client = StandInAsyncClient(latency=0)
+        first = self.fill(first_client, concurrency=4, response_cache=response_cache)
+        reworded_output = dict(chunked_output, EENT={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': ' Impaired  vision bilaterally.'}, cardiovascular={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'None'})
+        second_client = StandInAsyncClient(latency=0)
+        second = asyncio.run(afill_form_from_chunks(self.form_dataframe, reworded_output, async_client=second_client, registry=ResponseModelRegistry(path=None), response_cache=response_cache))
+        self.assertEqual(second, first)
+        self.assertEqual(second_client.number_of_calls, 0)
+
+        changed_output = dict(chunked_output, cardiovascular={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'click present'})
+        third_client = StandInAsyncClient(latency=0)
+        asyncio.run(afill_form_from_chunks(self.form_dataframe, changed_output, async_client=third_client, registry=ResponseModelRegistry(path=None), response_cache=response_cache))
+        changed_rows = select_candidate_rows(self.form_dataframe, {'cardiovascular': changed_output['cardiovascular']})
+        self.assertEqual(third_client.number_of_calls, len(changed_rows))
+
+    def test_response_cache_expiry_and_eviction(self):
+        """Expired entries miss and the least recently used entries are evicted."""
+        response_cache = ResponseCache(":memory:", ttl_seconds=-1)
+        response_cache.put("key", "Cardiac WDL [25540]", "WDL")
+        self.assertIsNone(response_cache.get("key"))
+        response_cache = ResponseCache(":memory:", max_entries=2)
+        for key in ("a", "b", "c"):
+            response_cache.put(key, "row", key)
+            response_cache.get(key)
+        response_cache.evict()
+        self.assertIsNone(response_cache.get("a"))
+        self.assertEqual(response_cache.get("c"), {"row_name": "row", "answer": "c"})
+
+    def test_telemetry_records_usage_and_retries(self):
+        """Every call is recorded with the usage the client reported and its retries."""
+        telemetry = Telemetry("note")
+        client = StandInAsyncClient(latency=0, rate_limit_probability=0.2)
+        self.fill(client, concurrency=4, telemetry=telemetry)
+        summary = telemetry.summary()
+        self.assertEqual(summary["total"]["calls"], client.number_of_calls - client.number_of_rate_limits)
+        self.assertEqual(summary["total"]["retries"], client.number_of_rate_limits)
+        self.assertGreater(summary["stages"]["form_filling"]["prompt_tokens"], 0)
+        self.assertIn("Cardiac", summary["groups"])
+        with tempfile.TemporaryDirectory() as directory:
+            telemetry.save(directory, "note")
+            with open(os.path.join(directory, "note.jsonl")) as file:
+                self.assertEqual(len(file.readlines()), summary["total"]["calls"])
+
+    def test_retrieval_shortlists_rows_and_options(self):
+        """Only rows sharing vocabulary with a system's exceptions text are sent, with fewer options."""
+        retrieval_index = RetrievalIndex(self.form_dataframe, top_k_rows=5, top_k_options=3)
+        candidate_rows = select_candidate_rows(self.form_dataframe, chunked_output)
+        retrieved_rows = retrieval_index.shortlist(candidate_rows, chunked_output)
+        self.assertTrue(0 < len(retrieved_rows) <= 5)
+        self.assertTrue(all('EENT' in names for names in retrieved_rows['assessment_names']))
+        self.assertTrue(all(len(options) <= 3 or options == candidate_rows.loc[label, 'options'] for label, options in retrieved_rows['options'].items()))
+        self.assertTrue(any('Impaired vision' in options for options in retrieved_rows['options']))
+        client = StandInAsyncClient(latency=0)
+        self.fill(client, concurrency=4, retrieval_index=retrieval_index)
+        self.assertEqual(client.number_of_calls, len(retrieved_rows))
+
+    def test_rules_fill_wdl_rows_without_calls(self):
+        """WDL rows are filled from the chunker output and never reach the client."""
+        rule_engine = RuleEngine.from_file()
+        self.assertEqual(rule_engine.validate(self.form_dataframe), [])
+        reference_client, client = StandInAsyncClient(latency=0), StandInAsyncClient(latency=0)
+        reference = self.fill(reference_client, concurrency=4)
+        filled_rows = self.fill(client, concurrency=4, rule_engine=rule_engine)
+        self.assertEqual(filled_rows["EENT WDL"], "Exceptions to WDL")
+        self.assertNotIn("Cardiac WDL", filled_rows)
+        self.assertEqual(client.number_of_calls, reference_client.number_of_calls - 2)
+        self.assertEqual({key: value for key, value in filled_rows.items() if "WDL" not in key}, {key: value for key, value in reference.items() if "WDL" not in key})
+
+    def test_recorded_responses_replay_offline(self):
+        """Responses recorded from one client are served back for the same requests, with injected errors retried."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.jsonl")
+            recorded = self.fill(RecordingAsyncClient(ResponseStore(path), StandInAsyncClient(latency=0)), concurrency=4)
+            replay_client = make_async_client("replay", path, latency=0, error_probability=0.2)
+            self.assertEqual(self.fill(replay_client, concurrency=4), recorded)
+            self.assertEqual(replay_client.number_of_misses, 0)
+            self.assertGreater(replay_client.number_of_errors, 0)
+            self.assertEqual(self.fill(make_async_client("replay", os.path.join(directory, "missing.jsonl"), latency=0), concurrency=4), {})
+            with self.assertRaises(LookupError):
+                asyncio.run(replay_client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "not recorded"}], response_format={}))
+
+    def test_prefix_mode_shares_cached_prefix(self):
+        """The prefix layout fills the same rows as per-row requests. A short note stays under the cache minimum and bills more than row mode, a long one hits the cache on every call after the first."""
+        reference = self.fill(StandInAsyncClient(latency=0), concurrency=4)
+        self.assertEqual(self.fill(PrefixCachingStandInClient(), concurrency=1, mode="prefix"), reference)
+        row, prefix = measure_prefix_reuse(self.form_dataframe, ["row", "prefix"], chunked_output)
+        self.assertEqual(prefix["calls_with_cached_prefix"], 0)
+        self.assertGreater(prefix["billed_relative_to_row"], 1)
+        long_note = dict(chunked_output, EENT={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'impaired vision bilaterally, ' * 200})
+        row, prefix = measure_prefix_reuse(self.form_dataframe, ["row", "prefix"], long_note, cached_token_price=0.25)
+        self.assertEqual(prefix["calls_with_cached_prefix"], prefix["calls"] - 1)
+        self.assertEqual(prefix["billed_prompt_tokens"], prefix["prompt_tokens"] - 0.75 * prefix["cached_tokens"])
+        self.assertEqual(prefix["billed_relative_to_row"], prefix["billed_prompt_tokens"] / row["billed_prompt_tokens"])
+
+    def test_batch_backfill_matches_interactive_fill(self):
+        """A batch job over several notes fills each note as the interactive path does, and failed requests stay unfilled."""
+        reference = self.fill(StandInAsyncClient(latency=0), concurrency=4)
+        other_output = dict(chunked_output, EENT={'is_referred_to_in_summary': False, 'exceptions_to_within_defined_limits': None})
+        other_reference = asyncio.run(afill_form_from_chunks(self.form_dataframe, other_output, async_client=StandInAsyncClient(latency=0), registry=ResponseModelRegistry(path=None)))
+        with tempfile.TemporaryDirectory() as directory:
+            chunks_file_paths = []
+            for note_name, output in (("note_1", chunked_output), ("note_2", other_output)):
+                chunks_file_paths.append(os.path.join(directory, "chunks", f"{note_name}.json"))
+                os.makedirs(os.path.dirname(chunks_file_paths[-1]), exist_ok=True)
+                with open(chunks_file_paths[-1], 'w') as file:
+                    json.dump(output, file)
+            client = StubBatchClient()
+            response_cache = ResponseCache(":memory:")
+            manifest_path = submit_backfill(chunks_file_paths, client, self.form_dataframe, folder=os.path.join(directory, "batches"), response_cache=response_cache)
+            filled_forms = finish_backfill(manifest_path, client, poll_seconds=0, response_cache=response_cache)
+            self.assertEqual(filled_forms[chunks_file_paths[0]], reference)
+            self.assertEqual(filled_forms[chunks_file_paths[1]], other_reference)
+            with open(os.path.join(directory, "filled_forms", "note_1.json")) as file:
+                self.assertEqual(json.load(file), reference)
+            self.assertEqual(client.number_of_requests, len(select_candidate_rows(self.form_dataframe, chunked_output)) + len(select_candidate_rows(self.form_dataframe, other_output)))
+            with open(submit_backfill(chunks_file_paths, client, self.form_dataframe, folder=os.path.join(directory, "batches"), response_cache=response_cache)) as file:
+                self.assertIsNone(json.load(file)["batch_id"])
+
+            failing_client = StubBatchClient(error_probability=0.5)
+            manifest_path = submit_backfill(chunks_file_paths[:1], failing_client, self.form_dataframe, folder=os.path.join(directory, "batches"))
+            filled_rows = finish_backfill(manifest_path, failing_client, poll_seconds=0)[chunks_file_paths[0]]
+            self.assertGreater(failing_client.number_of_errors, 0)
+            self.assertLess(len(filled_rows), len(reference))
+            self.assertTrue(all(reference[row_name] == answer for row_name, answer in filled_rows.items()))
+
+    def test_rows_sharing_a_name_are_sent_once(self):
+        """Only the last row of each filled name is sent, earlier ones only when it comes back unfilled, with the same output as sending every row."""
+        neurological_output = dict(chunked_output, neurological={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'pupils sluggish'})
+        def responder(messages, response_format):
+            if "Glasgow Coma Scale (2-5 years)" in messages[1]["content"]:
+                return {"line_item_cannot_be_filled_with_the_provided_information": True, "line_item_entry_if_sufficient_information": None}
+            return first_option_responder(messages, response_format)
+        registry = ResponseModelRegistry(path=None)
+        candidate_rows = select_candidate_rows(self.form_dataframe, neurological_output).to_dict('records')
+        answers = []
+        for row in candidate_rows:
+            messages, response_format = build_row_request(row, neurological_output, registry)
+            answers.append(parse_row_answer(row, make_completion(json.dumps(responder(messages, response_format)), make_usage(0, 0)).choices[0].message))
+        client = StandInAsyncClient(latency=0, responder=responder)
+        filled_rows = asyncio.run(afill_form_from_chunks(self.form_dataframe, neurological_output, async_client=client, registry=registry))
+        self.assertEqual(filled_rows, assemble_filled_rows(answers))
+        self.assertIn("Eye Opening", filled_rows)
+        self.assertLess(client.number_of_calls, len(candidate_rows))
+        self.assertGreater(client.number_of_calls, len({row["filled_name"] for row in candidate_rows}))
+
+    def test_refill_only_sends_changed_systems(self):
+        """Refilling after a correction sends only the rows of the changed systems and matches a full fill."""
+        previous = self.fill(StandInAsyncClient(latency=0), concurrency=4)
+        corrected_output = dict(chunked_output, cardiovascular={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': 'click present'}, respiratory={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': None})
+        self.assertEqual(changed_systems(chunked_output, dict(corrected_output, EENT={'is_referred_to_in_summary': True, 'exceptions_to_within_defined_limits': ' Impaired vision bilaterally.'})), {'cardiovascular', 'respiratory'})
+        reference = asyncio.run(afill_form_from_chunks(self.form_dataframe, corrected_output, async_client=StandInAsyncClient(latency=0), registry=ResponseModelRegistry(path=None)))
+        client = StandInAsyncClient(latency=0)
+        filled_rows, changed = refill_form(self.form_dataframe, chunked_output, previous, corrected_output, async_client=client, registry=ResponseModelRegistry(path=None))
+        self.assertEqual(filled_rows, reference)
+        self.assertEqual(client.number_of_calls, len(select_candidate_rows(self.form_dataframe, {system: corrected_output[system] for system in changed})))
+        unchanged_client = StandInAsyncClient(latency=0)
+        self.assertEqual(refill_form(self.form_dataframe, corrected_output, filled_rows, corrected_output, async_client=unchanged_client)[0], filled_rows)
+        self.assertEqual(unchanged_client.number_of_calls, 0)
+
+    def test_journal_resumes_and_retries_failed_rows(self):
+        """Failed rows are journaled and a resumed fill only sends them, tolerating a line cut short by a crash. Only failures of the current run are reported."""
+        reference = self.fill(StandInAsyncClient(latency=0), concurrency=4)
+        def failing_responder(messages, response_format):
+            if "Cardiac WDL" in messages[1]["content"] or "Edema" in messages[1]["content"]:
+                raise ValueError("malformed response")
+            return first_option_responder(messages, response_format)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "journals", "note.jsonl")
+            journal = FillJournal(path)
+            partial = self.fill(StandInAsyncClient(latency=0, responder=failing_responder), concurrency=4, journal=journal)
+            journal.close()
+            self.assertIn("Cardiac WDL [25540]", [entry["row_name"] for entry in journal.failed()])
+            self.assertNotIn("Cardiac WDL", partial)
+            with open(path, 'a') as file:
+                file.write('{"key": "cut short')
+            journal = FillJournal(path)
+            self.assertEqual(journal.failed(), [])
+            failed_rows = [entry for entry in journal.entries.values() if entry["error"]]
+            self.assertIn("Cardiac WDL [25540]", [entry["row_name"] for entry in failed_rows])
+            client = StandInAsyncClient(latency=0)
+            self.assertEqual(self.fill(client, concurrency=4, journal=journal), reference)
+            self.assertEqual(client.number_of_calls, len(failed_rows))
+            self.assertEqual(journal.failed(), [])
+            journal.close()
+            reopened = FillJournal(path)
+            reopened.close()
+            self.assertEqual(reopened.entries, journal.entries)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import time
+import tempfile
+import unittest
+from utils.stage_cache import StageCache, hash_parts
+
+class TestStageCache(unittest.TestCase):
+
+    def test_round_trip_and_content_keys(self):
+        """Values come back by content hash, and different inputs get different keys."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = StageCache(directory)
+            key = hash_parts(b"audio bytes", "large")
+            self.assertIsNone(cache.get("transcriptions", key))
+            cache.put("transcriptions", key, {"text": "Neuro WDL"})
+            self.assertEqual(cache.get("transcriptions", key), {"text": "Neuro WDL"})
+            self.assertNotEqual(key, hash_parts(b"audio bytes", "base"))
+            self.assertEqual(hash_parts({"a": 1, "b": 2}), hash_parts({"b": 2, "a": 1}))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Going over the size limit evicts the entries read least recently."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = StageCache(directory, max_bytes=200)
+            for index in range(3):
+                cache.put("chunks", str(index), "x" * 60)
+                os.utime(cache.path("chunks", str(index)), (time.time() - 100 + index, time.time() - 100 + index))
+            cache.get("chunks", "0")
+            cache.put("chunks", "3", "x" * 60)
+            self.assertIsNotNone(cache.get("chunks", "0"))
+            self.assertIsNone(cache.get("chunks", "1"))
+            self.assertIsNotNone(cache.get("chunks", "3"))
+
+    def test_overwrites_do_not_grow_the_tracked_size(self):
+        """Rewriting a key counts only the size difference towards max_bytes."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = StageCache(directory)
+            cache.put("chunks", "0", "x" * 60)
+            cache.put("chunks", "0", "x" * 60)
+            cache.put("chunks", "0", "x" * 60)
+            self.assertEqual(cache.size, sum(size for _, size, _ in cache.entries()))
+
+if __name__ == '__main__':
+    unittest.main()
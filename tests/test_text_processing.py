@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import asyncio
+import unittest
+from src.text_processing.process_form import process_json_file, load_form_index, determine_categories
+from src.text_processing.chunker import BodySystem, achunk_transcription
+from utils.llm_client import StandInAsyncClient
+
+class TestFormIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.form_path = os.path.join(self.directory, "form.json")
+        self.index_path = os.path.join(self.directory, "form_index.pkl")
+        shutil.copy("./form.json", self.form_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_matches_processed_form(self):
+        """The compiled index holds the same rows as flattening the JSON."""
+        form_dataframe = load_form_index(self.form_path, self.index_path)
+        self.assertTrue(os.path.exists(self.index_path))
+        self.assertTrue(form_dataframe.equals(process_json_file(self.form_path)))
+        body_system_rows = form_dataframe.attrs['body_system_rows']
+        self.assertEqual(body_system_rows['cardiovascular'], form_dataframe.index[form_dataframe['assessment_names'].apply(lambda names: 'cardiovascular' in names)].tolist())
+
+    def test_index_rebuilt_when_form_changes(self):
+        """A stale index is recompiled from the edited form."""
+        version = load_form_index(self.form_path, self.index_path).attrs['form_version']
+        with open(self.form_path, 'r') as file:
+            form = file.read()
+        with open(self.form_path, 'w') as file:
+            file.write(form.replace('"Neurological WDL [25482]"', '"Neuro WDL [25482]"', 1))
+        form_dataframe = load_form_index(self.form_path, self.index_path)
+        self.assertNotEqual(form_dataframe.attrs['form_version'], version)
+        self.assertEqual(form_dataframe.loc[0, 'row_name'], "Neuro WDL [25482]")
+
+    def test_templates_are_selected_by_id_or_name(self):
+        """Selecting a template keeps only its rows, with the body system index of the whole form."""
+        form_dataframe = load_form_index(self.form_path, self.index_path, templates=["icu"])
+        self.assertEqual(set(form_dataframe['template_name']), {"ICU"})
+        self.assertEqual(form_dataframe['row_name'].tolist(), process_json_file(self.form_path, templates=["0"])['row_name'].tolist())
+        self.assertIn('body_system_rows', form_dataframe.attrs)
+        self.assertEqual(form_dataframe.loc[0, 'filled_name'], "Neurological WDL")
+        with self.assertRaises(ValueError):
+            load_form_index(self.form_path, self.index_path, templates=["Unknown"])
+
+    def test_determine_categories(self):
+        """Groups shared by several body systems map to all of them."""
+        self.assertEqual(determine_categories(" Mucositis Assessment "), ['EENT', 'gastrointestinal'])
+        self.assertEqual(determine_categories("Unknown group"), [])
+
+def chunk_responder(messages, response_format):
+    """Answers per-system and all-system chunker requests, failing the respiratory system."""
+    if response_format["json_schema"]["name"] == "nurse_summary_parsed":
+        return {body_system: {"is_referred_to_in_summary": True, "exceptions_to_within_defined_limits": None} for body_system in BodySystem.body_system_list}
+    if "respiratory system" in messages[0]["content"]:
+        raise ValueError("malformed response")
+    return {"is_referred_to_in_summary": "cardiovascular" in messages[0]["content"], "exceptions_to_within_defined_limits": None}
+
+class TestChunker(unittest.TestCase):
+
+    def test_systems_are_chunked_concurrently_and_failures_kept_partial(self):
+        """All systems are requested at once and one failing system does not discard the others."""
+        client = StandInAsyncClient(latency=0.01, responder=chunk_responder)
+        chunked_output = asyncio.run(achunk_transcription("CV WDL except click present", async_client=client))
+        self.assertEqual(client.max_in_flight, len(BodySystem.body_system_list))
+        self.assertNotIn("respiratory", chunked_output)
+        self.assertEqual(len(chunked_output), len(BodySystem.body_system_list) - 1)
+        self.assertTrue(chunked_output["cardiovascular"]["is_referred_to_in_summary"])
+
+    def test_single_call_mode(self):
+        """All nine systems come back from one request."""
+        client = StandInAsyncClient(latency=0, responder=chunk_responder)
+        chunked_output = asyncio.run(achunk_transcription("Pt neuro WDL", async_client=client, single_call=True))
+        self.assertEqual(client.number_of_calls, 1)
+        self.assertEqual(list(chunked_output), BodySystem.body_system_list)
+
+if __name__ == '__main__':
+    unittest.main()
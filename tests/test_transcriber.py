@@ -1,18 +1,36 @@
 import os
+import json
+import tempfile
+import importlib.util
+import threading
 import unittest
+import urllib.error
+import urllib.request
+import numpy as np
+import soundfile as sf
+from src.audio_processing import audio_cache
+from src.audio_processing.audio_cache import AudioCache, WHISPER_SAMPLE_RATE
+from src.audio_processing.backends import BACKENDS, FakeBackend, installed_backends
 from src.audio_processing.transcriber import load_model, transcribe_audio
+from src.audio_processing.parallel_transcriber import ParallelTranscriber, segment_bounds
+from http.server import ThreadingHTTPServer
+from src.audio_processing.transcription_server import TranscriptionClient, TranscriptionRequestHandler, TranscriptionWorker
+from src.main import transcribe_note
+from utils.stage_cache import StageCache
 
 class TestTranscriber(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        """Load the Whisper model once for all tests to save time."""
-        cls.model = load_model("base")
+        """Use the running transcription server, which keeps the model loaded across test runs."""
+        cls.client = TranscriptionClient()
+        if not cls.client.is_alive():
+            raise unittest.SkipTest("Transcription server is not running, start it with: python -m src.audio_processing.transcription_server --preload base")
 
     def test_transcribe_audio(self):
         """Test transcription of a sample audio file."""
         audio_path = 'data/test/audio/Mom 4 - 1.mp3'
-        transcribed_text = transcribe_audio(audio_path, self.model)
+        transcribed_text = self.client.transcribe(audio_path, "base")
         
         # Ensure transcribed text is not empty
         self.assertTrue(transcribed_text.strip(), "Transcription is empty.")
@@ -20,7 +38,122 @@ class TestTranscriber(unittest.TestCase):
     def test_file_not_found(self):
         """Test handling of a non-existing audio file."""
         with self.assertRaises(FileNotFoundError):
-            transcribe_audio('non_existent_file.mp3', self.model)
+            self.client.transcribe('non_existent_file.mp3', "base")
+
+class FakeModel():
+    def __init__(self):
+        self.number_of_calls = 0
+
+    def transcribe(self, audio):
+        self.number_of_calls += 1
+        return {"text": f"transcript of {len(audio)} samples"}
+
+class TestTranscriptionServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        audio_cache._audio_cache = AudioCache(self.directory.name)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), TranscriptionRequestHandler)
+        self.server.worker = TranscriptionWorker()
+        self.model = FakeModel()
+        self.server.worker.models["base"] = self.model
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = TranscriptionClient(f"http://127.0.0.1:{self.server.server_address[1]}")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        audio_cache._audio_cache = None
+        self.directory.cleanup()
+
+    def test_model_stays_resident_across_jobs(self):
+        """Jobs reuse the loaded model instead of loading it per request."""
+        self.assertTrue(self.client.is_alive())
+        first = self.client.transcribe('data/test/audio/Mom 4 - 1.mp3', "base")
+        second = self.client.transcribe('data/test/audio/Tanay 3.mp3', "base")
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.model.number_of_calls, 2)
+
+    def test_file_not_found(self):
+        """A missing file on the server surfaces as FileNotFoundError in the client."""
+        with self.assertRaises(FileNotFoundError):
+            self.client.transcribe('non_existent_file.mp3', "base")
+
+    def test_malformed_request_is_rejected(self):
+        """A body that is not JSON, or has no audio_path, gets a 400 and the server keeps serving."""
+        for body in (b"not json", b"{}"):
+            request = urllib.request.Request(f"{self.client.url}/transcribe", data=body, headers={"Content-Type": "application/json"})
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request, timeout=5)
+            self.assertEqual(context.exception.code, 400)
+            self.assertIn("error", json.loads(context.exception.read()))
+        self.assertTrue(self.client.is_alive())
+
+    def test_cached_transcripts_are_keyed_by_the_server_backend(self):
+        """A transcript cached under one server backend is not reused when the server runs another."""
+        self.server.worker.backend = "fake"
+        self.assertEqual(self.client.health()["backend"], "fake")
+        cache = StageCache(os.path.join(self.directory.name, "stages"))
+        audio_path = 'data/test/audio/Mom 4 - 1.mp3'
+        transcribe_note(audio_path, "base", self.client, cache=cache)
+        transcribe_note(audio_path, "base", self.client, cache=cache)
+        self.assertEqual(self.model.number_of_calls, 1)
+        self.server.worker.backend = "faster-whisper"
+        transcribe_note(audio_path, "base", self.client, cache=cache)
+        self.assertEqual(self.model.number_of_calls, 2)
+
+class TestBackends(unittest.TestCase):
+
+    def test_backend_selected_by_name(self):
+        model = load_model("base", "fake")
+        self.assertIsInstance(model, FakeBackend)
+        self.assertEqual(transcribe_audio(np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32), model), "Neuro WDL. Cardiac WDL.")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            load_model("base", "does-not-exist")
+
+    def test_installed_backends(self):
+        """Only backends whose package imports are listed, and the fake one only on request."""
+        self.assertNotIn("fake", installed_backends())
+        self.assertIn("fake", installed_backends(include_fake=True))
+        for name in installed_backends():
+            self.assertIsNotNone(importlib.util.find_spec(BACKENDS[name].package))
+
+class LengthModel():
+    def transcribe(self, audio):
+        return {"text": f"{len(audio)}"}
+
+def load_length_model(model_name):
+    return LengthModel()
+
+class TestParallelTranscriber(unittest.TestCase):
+
+    def setUp(self):
+        t = np.arange(10 * WHISPER_SAMPLE_RATE) / WHISPER_SAMPLE_RATE
+        self.samples = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+        self.samples[int(4.5 * WHISPER_SAMPLE_RATE):int(4.8 * WHISPER_SAMPLE_RATE)] = 0.0
+
+    def test_segments_cut_in_silence(self):
+        bounds = segment_bounds(self.samples, segment_seconds=4.0, search_seconds=1.0)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], len(self.samples))
+        self.assertTrue(4.5 <= bounds[0][1] / WHISPER_SAMPLE_RATE <= 4.8)
+        self.assertTrue(all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:])))
+
+    def test_segments_are_stitched_in_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            audio_paths = []
+            for index, seconds in enumerate((10, 3)):
+                audio_paths.append(os.path.join(directory, f"note_{index}.wav"))
+                sf.write(audio_paths[-1], self.samples[:seconds * WHISPER_SAMPLE_RATE], WHISPER_SAMPLE_RATE)
+            cache = AudioCache(os.path.join(directory, "cache"))
+            with ParallelTranscriber("base", workers=2, segment_seconds=4.0, model_loader=load_length_model, audio_cache=cache) as transcriber:
+                texts = transcriber.transcribe_files(audio_paths)
+        first_note = [int(length) for length in texts[0].split()]
+        self.assertGreater(len(first_note), 1)
+        self.assertEqual(sum(first_note), 10 * WHISPER_SAMPLE_RATE)
+        self.assertEqual(texts[1], str(3 * WHISPER_SAMPLE_RATE))
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
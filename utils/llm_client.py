@@ -0,0 +1,356 @@
+# llm_client.py
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import weakref
+import threading
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
+from utils.stage_cache import hash_parts
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# "live" calls the API, "record" calls it and saves the responses, "replay" serves saved responses offline.
+LLM_CLIENT_MODE = os.getenv("LLM_CLIENT_MODE", "live")
+LLM_RECORDINGS_PATH = os.getenv("LLM_RECORDINGS_PATH", "./data/recordings/llm_responses.jsonl")
+LLM_REPLAY_LATENCY = float(os.getenv("LLM_REPLAY_LATENCY", 0.0))
+LLM_REPLAY_RATE_LIMIT_PROBABILITY = float(os.getenv("LLM_REPLAY_RATE_LIMIT_PROBABILITY", 0.0))
+LLM_REPLAY_ERROR_PROBABILITY = float(os.getenv("LLM_REPLAY_ERROR_PROBABILITY", 0.0))
+
+_async_clients = weakref.WeakKeyDictionary()
+_default_client = None
+
+def get_live_async_client():
+    """
+    Lazily create the AsyncOpenAI client shared by everything running on the current event loop.
+    The connection pool is bound to its loop, so threads running their own loop get their own client.
+
+    Retries are disabled on the SDK side because acall_with_backoff owns the retry policy.
+    Returns:
+        AsyncOpenAI: The shared async client.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _async_clients[loop]
+
+def make_async_client(mode: str = LLM_CLIENT_MODE, recordings_path: str = LLM_RECORDINGS_PATH, latency: float = LLM_REPLAY_LATENCY, rate_limit_probability: float = LLM_REPLAY_RATE_LIMIT_PROBABILITY, error_probability: float = LLM_REPLAY_ERROR_PROBABILITY, fallback_responder=None):
+    """
+    Creates the client for a mode: None for "live", which resolves the shared AsyncOpenAI client
+    per event loop, a RecordingAsyncClient for "record" and a ReplayAsyncClient for "replay".
+    latency, rate_limit_probability, error_probability and fallback_responder only apply to replay.
+    Without a fallback_responder, replaying a request that was not recorded raises.
+    """
+    if mode == "live":
+        return None
+    if mode == "record":
+        return RecordingAsyncClient(ResponseStore(recordings_path))
+    if mode == "replay":
+        return ReplayAsyncClient(ResponseStore(recordings_path), latency, rate_limit_probability, fallback_responder, error_probability=error_probability)
+    raise ValueError(f"Unknown LLM client mode {mode!r}, expected live, record or replay")
+
+def get_async_client():
+    """
+    The client used when none is injected, selected by the LLM_CLIENT_MODE environment variable.
+    Nothing is created at import time, so the pipeline imports and runs offline in replay mode
+    without an API key.
+    """
+    global _default_client
+    if LLM_CLIENT_MODE == "live":
+        return get_live_async_client()
+    if _default_client is None:
+        _default_client = make_async_client()
+    return _default_client
+
+def backoff_delay(attempt: int, error: Exception = None, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Determines how long to wait before retrying a failed call.
+
+    A 'retry-after' header on a rate limit response is honoured, otherwise the delay grows
+    exponentially with full jitter.
+    Args:
+        attempt (int): Zero based index of the retry being scheduled.
+        error (Exception): The error that triggered the retry.
+        base_delay (float): Delay in seconds for the first retry.
+        max_delay (float): Upper bound for any single delay.
+    Returns:
+        float: Seconds to sleep.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            return min(float(retry_after), max_delay)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+async def acall_with_backoff(function, *args, max_retries: int = 5, base_delay: float = 1.0, call_stats: dict = None, **kwargs):
+    """
+    Await an OpenAI call, retrying rate limit, connection and server errors with backoff.
+    Args:
+        function: Coroutine function to call, e.g. client.chat.completions.create.
+        max_retries (int): Number of retries before the last error is raised.
+        base_delay (float): Delay in seconds for the first retry.
+        call_stats (dict): If given, its "retries" entry is set to the number of retries made.
+    Returns:
+        The result of the call.
+    """
+    for attempt in range(max_retries + 1):
+        if call_stats is not None:
+            call_stats["retries"] = attempt
+        try:
+            return await function(*args, **kwargs)
+        except RETRYABLE_ERRORS as error:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, error, base_delay))
+
+async def acreate_completion(async_client, model: str, messages: list, response_format: dict, max_retries: int = 5, telemetry=None, stage: str = None, group: str = None, row: str = None):
+    """
+    chat.completions.create with backoff, recording usage, latency, retries and errors in telemetry.
+    Returns:
+        The chat completion.
+    """
+    call_stats = {"retries": 0}
+    t = time.perf_counter()
+    try:
+        completion = await acall_with_backoff(
+            async_client.chat.completions.create,
+            model=model,
+            messages=messages,
+            response_format=response_format,
+            max_retries=max_retries,
+            call_stats=call_stats
+        )
+    except Exception as e:
+        if telemetry is not None:
+            telemetry.record(stage, group, row, model, latency=time.perf_counter() - t, retries=call_stats["retries"], error=f"{type(e).__name__}: {e}")
+        raise
+    if telemetry is not None:
+        telemetry.record(stage, group, row, model, usage=completion.usage, latency=time.perf_counter() - t, retries=call_stats["retries"])
+    return completion
+
+def first_option_responder(messages, response_format):
+    """
+    Default answer of the stand-in client: the first option allowed by each row's response schema,
+    for single-row and multi-row schemas alike, or the first option listed in the prompt when the
+    schema is free text.
+    """
+    schema = response_format["json_schema"]["schema"]
+    listed_option = re.search(r'Options: "([^"]*)"', messages[-1]["content"])
+    def row_answer(row_schema):
+        entry_schema = row_schema["properties"]["line_item_entry_if_sufficient_information"]
+        if "$ref" in entry_schema:
+            entry_schema = schema["$defs"][entry_schema["$ref"].split("/")[-1]]
+        entry = entry_schema["enum"][0] if "enum" in entry_schema else listed_option and listed_option.group(1)
+        return {"line_item_cannot_be_filled_with_the_provided_information": False, "line_item_entry_if_sufficient_information": entry}
+    if "line_item_entry_if_sufficient_information" in schema["properties"]:
+        return row_answer(schema)
+    return {field_name: row_answer(row_schema) for field_name, row_schema in schema["properties"].items()}
+
+def pipeline_responder(messages, response_format):
+    """
+    Stand-in answers for every request of the pipeline: each body system is referred to without
+    exceptions, and form rows get the first option of their schema.
+    """
+    name = response_format["json_schema"]["name"]
+    if name == "Chunk":
+        return {"is_referred_to_in_summary": True, "exceptions_to_within_defined_limits": None}
+    if name == "nurse_summary_parsed":
+        return {body_system: {"is_referred_to_in_summary": True, "exceptions_to_within_defined_limits": None} for body_system in response_format["json_schema"]["schema"]["properties"]}
+    return first_option_responder(messages, response_format)
+
+def make_usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens, prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+def make_completion(content: str, usage):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, refusal=None))], usage=usage)
+
+class StandInAsyncClient():
+    """
+    Local replacement for AsyncOpenAI that answers chat.completions.create calls after an
+    injected latency, and fails a fraction of them with a 429 or a 500, for benchmarks and tests.
+    """
+    def __init__(self, latency: float = 0.1, rate_limit_probability: float = 0.0, responder=first_option_responder, seed: int = 0, error_probability: float = 0.0):
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.error_probability = error_probability
+        self.responder = responder
+        self.random = random.Random(seed)
+        self.number_of_calls = 0
+        self.number_of_rate_limits = 0
+        self.number_of_errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, response_format, **kwargs):
+        self.number_of_calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.random.random() < self.rate_limit_probability:
+                self.number_of_rate_limits += 1
+                response = httpx.Response(429, headers={"retry-after": "0"}, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+                raise RateLimitError("Rate limit reached (stand-in)", response=response, body=None)
+            if self.random.random() < self.error_probability:
+                self.number_of_errors += 1
+                response = httpx.Response(500, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+                raise InternalServerError("Server error (stand-in)", response=response, body=None)
+            return self.respond(model, messages, response_format)
+        finally:
+            self.in_flight -= 1
+
+    def respond(self, model, messages, response_format):
+        content = json.dumps(self.responder(messages, response_format))
+        return make_completion(content, make_usage(len(json.dumps(messages)) // 4, len(content) // 4))
+
+class ResponseStore():
+    """
+    Recorded chat completions, one JSON line per request with the hash of the request, the
+    response content and its token usage.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry["key"]] = entry
+
+    @staticmethod
+    def request_key(model: str, messages: list, response_format: dict) -> str:
+        return hash_parts(model, messages, response_format)
+
+    def get(self, key: str):
+        return self.responses.get(key)
+
+    def add(self, key: str, content: str, usage):
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        entry = {
+            "key": key,
+            "content": content,
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cached_tokens": getattr(prompt_tokens_details, "cached_tokens", 0) or 0,
+        }
+        with self.lock:
+            self.responses[key] = entry
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(entry) + "\n")
+
+class RecordingAsyncClient():
+    """
+    Wraps a live async client and saves every successful completion to a ResponseStore. Without
+    an explicit client, the shared AsyncOpenAI client of the running event loop is used.
+    """
+    def __init__(self, store: ResponseStore, async_client=None):
+        self.store = store
+        self.async_client = async_client
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, response_format, **kwargs):
+        completion = await (self.async_client or get_live_async_client()).chat.completions.create(model=model, messages=messages, response_format=response_format, **kwargs)
+        message = completion.choices[0].message
+        if message.content and not getattr(message, "refusal", None):
+            self.store.add(ResponseStore.request_key(model, messages, response_format), message.content, completion.usage)
+        return completion
+
+class ReplayAsyncClient(StandInAsyncClient):
+    """
+    Stand-in client that answers from a ResponseStore with the recorded content and usage.
+    Requests that were not recorded raise LookupError, unless a fallback responder is given, as the
+    benchmark does: its stand-in answers are then counted as misses.
+    """
+    def __init__(self, store: ResponseStore, latency: float = 0.0, rate_limit_probability: float = 0.0, fallback_responder=None, seed: int = 0, error_probability: float = 0.0):
+        super().__init__(latency, rate_limit_probability, fallback_responder, seed, error_probability)
+        self.store = store
+        self.number_of_misses = 0
+
+    def respond(self, model, messages, response_format):
+        key = ResponseStore.request_key(model, messages, response_format)
+        entry = self.store.get(key)
+        if entry is None:
+            self.number_of_misses += 1
+            if self.responder is None:
+                raise LookupError(f"No recorded response for request {key} in {self.store.path}, record it with LLM_CLIENT_MODE=record")
+            return super().respond(model, messages, response_format)
+        return make_completion(entry["content"], make_usage(entry["prompt_tokens"], entry["completion_tokens"], entry["cached_tokens"]))
+
+class StubBatchClient():
+    """
+    Local replacement for the files and batches endpoints of the OpenAI client, for batch jobs in
+    tests and dry runs. A batch completes after it has been polled polls_to_complete times: every
+    request of its input file is answered by the responder, and a fraction fail with a 500.
+    """
+    def __init__(self, responder=pipeline_responder, polls_to_complete: int = 2, error_probability: float = 0.0, seed: int = 0):
+        self.responder = responder
+        self.polls_to_complete = polls_to_complete
+        self.error_probability = error_probability
+        self.random = random.Random(seed)
+        self.stored_files = {}
+        self.stored_batches = {}
+        self.number_of_requests = 0
+        self.number_of_errors = 0
+        self.files = SimpleNamespace(create=self.create_file, content=self.file_content)
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve_batch)
+
+    def add_file(self, text: str) -> str:
+        file_id = f"file-stub-{len(self.stored_files)}"
+        self.stored_files[file_id] = text
+        return file_id
+
+    def create_file(self, file, purpose: str):
+        content = file.read()
+        return SimpleNamespace(id=self.add_file(content.decode() if isinstance(content, bytes) else content), purpose=purpose)
+
+    def file_content(self, file_id: str):
+        return SimpleNamespace(text=self.stored_files[file_id])
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str, metadata: dict = None):
+        batch_id = f"batch-stub-{len(self.stored_batches)}"
+        self.stored_batches[batch_id] = {"id": batch_id, "status": "validating", "input_file_id": input_file_id, "output_file_id": None, "error_file_id": None, "endpoint": endpoint, "metadata": metadata, "polls": 0}
+        return SimpleNamespace(**self.stored_batches[batch_id])
+
+    def retrieve_batch(self, batch_id: str):
+        batch = self.stored_batches[batch_id]
+        batch["polls"] += 1
+        if batch["status"] != "completed":
+            batch["status"] = "in_progress"
+            if batch["polls"] >= self.polls_to_complete:
+                self.run_batch(batch)
+        return SimpleNamespace(**batch)
+
+    def run_batch(self, batch: dict):
+        outputs, errors = [], []
+        for line in self.stored_files[batch["input_file_id"]].splitlines():
+            request = json.loads(line)
+            body = request["body"]
+            self.number_of_requests += 1
+            result = {"id": f"batch_req-stub-{self.number_of_requests}", "custom_id": request["custom_id"], "error": None}
+            if self.random.random() < self.error_probability:
+                self.number_of_errors += 1
+                errors.append(dict(result, response={"status_code": 500, "body": {"error": {"message": "Server error (stub)"}}}))
+                continue
+            content = json.dumps(self.responder(body["messages"], body["response_format"]))
+            prompt_tokens, completion_tokens = len(json.dumps(body["messages"])) // 4, len(content) // 4
+            outputs.append(dict(result, response={"status_code": 200, "body": {
+                "object": "chat.completion",
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content, "refusal": None}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            }}))
+        batch["output_file_id"] = self.add_file("".join(json.dumps(output) + "\n" for output in outputs))
+        batch["error_file_id"] = self.add_file("".join(json.dumps(error) + "\n" for error in errors)) if errors else None
+        batch["status"] = "completed"
@@ -0,0 +1,112 @@
+# stage_cache.py
+import os
+import json
+import hashlib
+import threading
+
+STAGE_CACHE_PATH = os.getenv("STAGE_CACHE_PATH", "./data/cache")
+STAGE_CACHE_MAX_BYTES = int(os.getenv("STAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+def hash_parts(*parts) -> str:
+    """
+    Content hash of the inputs of a stage. Bytes are hashed as is, everything else as canonical JSON.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class StageCache():
+    """
+    Content-addressed on-disk cache of pipeline stage outputs, one JSON file per entry under
+    <root>/<stage>/. Reads refresh an entry's mtime and the least recently used entries are
+    evicted once the cache grows past max_bytes. Subclasses store other formats by overriding
+    extension, read and write.
+    """
+    extension = ".json"
+
+    def __init__(self, root: str = STAGE_CACHE_PATH, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, f"{key}{self.extension}")
+
+    def read(self, path: str):
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def write(self, file, value):
+        file.write(json.dumps(value).encode())
+
+    def get(self, stage: str, key: str):
+        """
+        Returns the cached value, or None on a miss.
+        """
+        path = self.path(stage, key)
+        try:
+            value = self.read(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, stage: str, key: str, value):
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            self.write(file, value)
+        entry_size = os.path.getsize(tmp_path)
+        try:
+            entry_size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += entry_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                if file.endswith(self.extension):
+                    stat = os.stat(os.path.join(directory, file))
+                    yield stat.st_mtime, stat.st_size, os.path.join(directory, file)
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache is back under 90% of max_bytes.
+        """
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            os.remove(path)
+            self.size -= size
+
+_stage_cache = None
+
+def get_stage_cache() -> StageCache:
+    global _stage_cache
+    if _stage_cache is None:
+        _stage_cache = StageCache()
+    return _stage_cache
@@ -0,0 +1,94 @@
+# telemetry.py
+import os
+import json
+import time
+import threading
+
+class Telemetry():
+    """
+    Collects one record per LLM call or cache hit of a note: stage, row group and row, the actual
+    token usage reported by the API, latency, retries and errors.
+    """
+    def __init__(self, note: str = None):
+        self.note = note
+        self.records = []
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, group: str = None, row: str = None, model: str = None, usage=None, latency: float = 0.0, retries: int = 0, cache_hit: bool = False, error: str = None):
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        record = {
+            "time": time.time(),
+            "note": self.note,
+            "stage": stage,
+            "group": group.strip() if group else group,
+            "row": row,
+            "model": model,
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cached_tokens": getattr(prompt_tokens_details, "cached_tokens", 0) or 0,
+            "latency_seconds": latency,
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "error": error,
+        }
+        with self.lock:
+            self.records.append(record)
+
+    @staticmethod
+    def aggregate(records) -> dict:
+        calls = [record for record in records if not record["cache_hit"]]
+        latencies = sorted(record["latency_seconds"] for record in calls)
+        return {
+            "calls": len(calls),
+            "cache_hits": len(records) - len(calls),
+            "errors": sum(1 for record in calls if record["error"]),
+            "retries": sum(record["retries"] for record in calls),
+            "prompt_tokens": sum(record["prompt_tokens"] for record in calls),
+            "completion_tokens": sum(record["completion_tokens"] for record in calls),
+            "cached_tokens": sum(record["cached_tokens"] for record in calls),
+            "latency_seconds_total": sum(latencies),
+            "latency_seconds_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_seconds_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        }
+
+    def summary(self) -> dict:
+        """
+        Totals per stage, per row group and overall.
+        """
+        with self.lock:
+            records = list(self.records)
+        stages, groups = {}, {}
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record)
+            if record["group"]:
+                groups.setdefault(record["group"], []).append(record)
+        return {
+            "note": self.note,
+            "total": self.aggregate(records),
+            "stages": {stage: self.aggregate(stage_records) for stage, stage_records in stages.items()},
+            "groups": {group: self.aggregate(group_records) for group, group_records in groups.items()},
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{'':<40} {'calls':>6} {'hits':>5} {'errors':>6} {'retries':>7} {'prompt':>8} {'cached':>8} {'output':>7} {'mean s':>7} {'p95 s':>6}"]
+        rows = [("total", summary["total"])] + [(f"stage {stage}", totals) for stage, totals in summary["stages"].items()]
+        rows += sorted(((f"  {group}", totals) for group, totals in summary["groups"].items()), key=lambda row: -row[1]["prompt_tokens"])
+        for name, totals in rows:
+            lines.append(f"{name[:40]:<40} {totals['calls']:>6} {totals['cache_hits']:>5} {totals['errors']:>6} {totals['retries']:>7} {totals['prompt_tokens']:>8} {totals['cached_tokens']:>8} {totals['completion_tokens']:>7} {totals['latency_seconds_mean']:>7.2f} {totals['latency_seconds_p95']:>6.2f}")
+        return "\n".join(lines)
+
+    def save(self, folder: str, base_name: str):
+        """
+        Writes the records to <folder>/<base_name>.jsonl and the summary to <folder>/<base_name>_summary.json.
+        """
+        os.makedirs(folder, exist_ok=True)
+        with self.lock:
+            records = list(self.records)
+        records_path = os.path.join(folder, f"{base_name}.jsonl")
+        with open(records_path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+        with open(os.path.join(folder, f"{base_name}_summary.json"), 'w') as file:
+            json.dump(self.summary(), file, indent=4)
+        print(f"Telemetry saved to {records_path}")